@@ -1,35 +1,38 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+from contextlib import asynccontextmanager
 import json
 
 from routers import ask, search, user, history, image
 from middleware.auth import get_current_user
-from services.firebase_service import init_firebase
+from services.health_monitor import health_monitor
+from services.usage_service import usage_tracker
+from services.warmup import startup_warmup
 
 load_dotenv()
 
-# Initialize Firebase
-init_firebase()
-
-# Rate limiter
-limiter = Limiter(key_func=get_remote_address)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Firebase is initialized here; the server accepts connections once this returns
+    await startup_warmup.run()
+    health_monitor.start()
+    usage_tracker.start()
+    yield
+    await startup_warmup.stop()
+    await health_monitor.stop()
+    await usage_tracker.stop()
 
 app = FastAPI(
     title="Whyred AI Backend API",
     version="1.0.0",
-    description="FastAPI backend for Whyred AI assistant"
+    description="FastAPI backend for Whyred AI assistant",
+    lifespan=lifespan
 )
 
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
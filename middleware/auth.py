@@ -1,8 +1,9 @@
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from firebase_admin import auth
 import logging
 
+from services.firebase_service import get_auth_client
+
 logger = logging.getLogger(__name__)
 security = HTTPBearer()
 
@@ -10,7 +11,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     """Verify Firebase ID token and return user info"""
     try:
         token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = get_auth_client().verify_id_token(token)
         return decoded_token
     except Exception as e:
         logger.error(f"Authentication error: {e}")
@@ -20,13 +21,22 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+async def get_admin_user(user=Depends(get_current_user)):
+    """Require an operator: a user whose ID token carries the `admin` custom claim"""
+    if user.get("admin") is not True:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Operator access required"
+        )
+    return user
+
 async def get_optional_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Optional authentication - returns None if no valid token"""
     try:
         if not credentials:
             return None
         token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = get_auth_client().verify_id_token(token)
         return decoded_token
     except:
         return None
\ No newline at end of file
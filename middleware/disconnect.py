@@ -0,0 +1,28 @@
+from fastapi import Request
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before the work finished"""
+
+async def run_until_disconnected(request: Request, coro, poll_interval: float = 0.5):
+    """Await coro, cancelling it as soon as the client disconnects"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info(f"Client disconnected from {request.url.path}, cancelling work")
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,44 @@
+from fastapi import HTTPException, Depends, Request, Response, status
+import logging
+import math
+
+from middleware.auth import get_current_user
+from services.rate_limiter import RateLimitResult, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+def _enforce(result: RateLimitResult, scope: str, key: str, response: Response) -> None:
+    headers = {
+        "X-RateLimit-Limit": str(rate_limiter.capacity(scope)),
+        "X-RateLimit-Remaining": str(result.remaining)
+    }
+    if not result.allowed:
+        logger.warning(f"Rate limit exceeded for {key} in scope {scope}")
+        headers["Retry-After"] = str(max(math.ceil(result.retry_after), 1))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers=headers
+        )
+    response.headers.update(headers)
+
+async def _check(scope: str, key: str, cost: float, response: Response) -> None:
+    try:
+        result = await rate_limiter.hit(scope, key, cost)
+    except Exception as e:
+        # Fail open: an unavailable limit store must not take the API down with it
+        logger.error(f"Rate limit store error for {key} in scope {scope}, allowing request: {e}")
+        return
+    _enforce(result, scope, key, response)
+
+def rate_limit(scope: str, cost: float = 1):
+    """Dependency limiting the authenticated user's requests in a scope"""
+    async def dependency(response: Response, user=Depends(get_current_user)):
+        await _check(scope, f"user:{user['uid']}", cost, response)
+    return dependency
+
+def client_rate_limit(scope: str, cost: float = 1):
+    """Dependency for unauthenticated endpoints, limiting by client address"""
+    async def dependency(request: Request, response: Response):
+        await _check(scope, f"ip:{request.client.host if request.client else 'unknown'}", cost, response)
+    return dependency
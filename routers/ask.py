@@ -1,21 +1,29 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import json
-import asyncio
+from contextlib import aclosing
 from datetime import datetime
 import logging
 
-from middleware.auth import get_current_user, get_optional_user
+from middleware.auth import get_admin_user, get_current_user, get_optional_user
+from middleware.disconnect import ClientDisconnected, run_until_disconnected
+from middleware.rate_limit import client_rate_limit, rate_limit
 from services.gemini_service import gemini_service
-from services.firebase_service import get_firestore_client
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from services.usage_service import TokenBudgetExceeded
+from services.health_monitor import health_monitor
+from services.model_router import model_router
+from services.scheduler import model_scheduler
+from services.history_store import history_store
+from services.key_pool import key_pool
+from services.warmup import startup_warmup
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
-limiter = Limiter(key_func=get_remote_address)
+
+# Request type -> model routing type
+ROUTING_TYPES = {"image": "vision", "code": "code"}
 
 class AskRequest(BaseModel):
     prompt: str
@@ -27,31 +35,62 @@ class TestRequest(BaseModel):
 
 @router.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    try:
-        is_healthy = await gemini_service.health_check()
-        model_info = gemini_service.get_model_info()
-        
-        return {
-            "status": "healthy" if is_healthy else "unhealthy",
+    """Health check endpoint, answered from the background health monitor"""
+    status = health_monitor.get_status()
+    probes = status.pop("models")
+    return {
+        "status": "healthy" if status["modelsHealthy"] else "unhealthy",
+        "timestamp": datetime.now().isoformat(),
+        **status,
+        "probes": probes,
+        "startup": startup_warmup.get_report(),
+        **gemini_service.get_model_info()
+    }
+
+@router.get("/live")
+async def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "alive", "timestamp": datetime.now().isoformat()}
+
+@router.get("/ready")
+async def readiness_check():
+    """Readiness probe: no critical warmup step is failing; model health is reported only"""
+    ready = startup_warmup.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
             "timestamp": datetime.now().isoformat(),
-            **model_info
-        }
-    except Exception as e:
-        logger.error(f"Health check error: {e}")
-        return {
-            "status": "error",
-            "error": str(e),
-            "timestamp": datetime.now().isoformat()
+            "ready": ready,
+            **health_monitor.get_status(),
+            "failedCriticalSteps": startup_warmup.failed_critical_steps()
         }
+    )
+
+@router.get("/queue", dependencies=[Depends(rate_limit("api"))])
+async def queue_stats(user=Depends(get_current_user)):
+    """Model call queue statistics for the current user"""
+    return {
+        "user": model_scheduler.get_user_stats(user['uid']),
+        "scheduler": model_scheduler.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
 
-@router.post("/test")
+@router.get("/keys", dependencies=[Depends(rate_limit("api"))])
+async def key_stats(user=Depends(get_admin_user)):
+    """Per-key request counts and cooldowns of the Gemini API key pool (operators only)"""
+    return {
+        "keys": key_pool.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.post("/test", dependencies=[Depends(client_rate_limit("model"))])
 async def test_endpoint(request: TestRequest):
     """Test endpoint without authentication"""
     try:
         logger.info(f"Test endpoint called with prompt: {request.prompt}")
         
-        response = await gemini_service.generate_text(request.prompt)
+        response = await gemini_service.generate_text(request.prompt, priority="batch")
         
         return {
             "response": response,
@@ -69,8 +108,7 @@ async def test_endpoint(request: TestRequest):
             "error": str(e)
         }
 
-@router.post("/")
-@limiter.limit("100/15minutes")
+@router.post("/", dependencies=[Depends(rate_limit("model"))])
 async def ask_endpoint(request: Request, ask_request: AskRequest, user=Depends(get_current_user)):
     """Main ask endpoint with authentication"""
     try:
@@ -81,38 +119,40 @@ async def ask_endpoint(request: Request, ask_request: AskRequest, user=Depends(g
         logger.info(f"Prompt: {ask_request.prompt[:100]}...")
 
         processing_start = datetime.now()
+        route = model_router.route(ROUTING_TYPES.get(ask_request.type, "text"), ask_request.prompt)
         
         # Generate response based on type
         if ask_request.type == "image":
             if not ask_request.imageData:
                 raise HTTPException(status_code=400, detail="Image data required for image analysis")
-            response = await gemini_service.generate_from_image(ask_request.prompt, ask_request.imageData)
+            generation = gemini_service.generate_from_image(
+                ask_request.prompt, ask_request.imageData, user_id=user['uid'], route=route
+            )
         elif ask_request.type == "code":
-            response = await gemini_service.generate_code(ask_request.prompt)
+            generation = gemini_service.generate_code(ask_request.prompt, user_id=user['uid'], route=route)
         elif ask_request.type == "search":
-            response = await gemini_service.generate_search(ask_request.prompt)
+            generation = gemini_service.generate_search(ask_request.prompt, user_id=user['uid'], route=route)
         else:
-            response = await gemini_service.generate_text(ask_request.prompt)
+            generation = gemini_service.generate_text(ask_request.prompt, user_id=user['uid'], route=route)
+
+        # Cancels the generation (and skips the history write) if the client goes away
+        response = await run_until_disconnected(request, generation)
 
         processing_time = (datetime.now() - processing_start).total_seconds() * 1000
         logger.info(f"Response generated in {processing_time:.0f}ms")
 
         # Save to history
         try:
-            db = get_firestore_client()
-            await asyncio.to_thread(
-                db.collection('chat_history').add,
-                {
-                    'userId': user['uid'],
-                    'prompt': ask_request.prompt,
-                    'response': response,
-                    'type': ask_request.type,
-                    'timestamp': datetime.now(),
-                    'processingTime': processing_time,
-                    'model': 'gemini-2.0-flash-exp',
-                    'success': True
-                }
-            )
+            await history_store.add({
+                'userId': user['uid'],
+                'prompt': ask_request.prompt,
+                'response': response,
+                'type': ask_request.type,
+                'timestamp': datetime.now(),
+                'processingTime': processing_time,
+                'model': route['model'],
+                'success': True
+            })
         except Exception as db_error:
             logger.error(f"Failed to save to history: {db_error}")
 
@@ -121,29 +161,31 @@ async def ask_endpoint(request: Request, ask_request: AskRequest, user=Depends(g
             "timestamp": datetime.now().isoformat(),
             "processingTime": processing_time,
             "type": ask_request.type,
+            "routing": route,
             "success": True
         }
 
     except HTTPException:
         raise
+    except ClientDisconnected:
+        logger.info(f"Client disconnected, skipped {ask_request.type} request for user: {user['uid']}")
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Ask endpoint error: {e}")
         
         # Try to save error to history
         try:
-            db = get_firestore_client()
-            await asyncio.to_thread(
-                db.collection('chat_history').add,
-                {
-                    'userId': user['uid'],
-                    'prompt': ask_request.prompt,
-                    'response': f"Error: {str(e)}",
-                    'type': ask_request.type,
-                    'timestamp': datetime.now(),
-                    'success': False,
-                    'error': str(e)
-                }
-            )
+            await history_store.add({
+                'userId': user['uid'],
+                'prompt': ask_request.prompt,
+                'response': f"Error: {str(e)}",
+                'type': ask_request.type,
+                'timestamp': datetime.now(),
+                'success': False,
+                'error': str(e)
+            })
         except Exception as db_error:
             logger.error(f"Failed to save error to history: {db_error}")
 
@@ -157,7 +199,7 @@ async def ask_endpoint(request: Request, ask_request: AskRequest, user=Depends(g
         else:
             raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/stream")
+@router.post("/stream", dependencies=[Depends(rate_limit("model"))])
 async def stream_endpoint(ask_request: AskRequest, user=Depends(get_current_user)):
     """Streaming endpoint for real-time responses"""
     try:
@@ -169,27 +211,44 @@ async def stream_endpoint(ask_request: AskRequest, user=Depends(get_current_user
                 # Send initial event
                 yield f"data: {json.dumps({'type': 'start', 'timestamp': datetime.now().isoformat()})}\n\n"
                 
-                response = await gemini_service.generate_text(ask_request.prompt)
+                processing_start = datetime.now()
+                response = ''
+                route = model_router.route("text", ask_request.prompt)
+                
+                # Relay upstream chunks; a client disconnect cancels this generator,
+                # which stops reading the upstream stream and skips the history write
+                chunks = gemini_service.generate_text_stream(ask_request.prompt, user_id=user['uid'], route=route)
+                async with aclosing(chunks):
+                    async for chunk in chunks:
+                        response += chunk
+                        
+                        yield f"data: {json.dumps({
+                            'type': 'chunk',
+                            'content': response
+                        })}\n\n"
                 
-                # Simulate streaming by sending chunks
-                words = response.split(' ')
-                current_text = ''
+                processing_time = (datetime.now() - processing_start).total_seconds() * 1000
                 
-                for i, word in enumerate(words):
-                    current_text += (' ' if i > 0 else '') + word
-                    
-                    yield f"data: {json.dumps({
-                        'type': 'chunk',
-                        'content': current_text,
-                        'progress': (i + 1) / len(words)
-                    })}\n\n"
-                    
-                    await asyncio.sleep(0.05)  # Small delay
+                # Save to history
+                try:
+                    await history_store.add({
+                        'userId': user['uid'],
+                        'prompt': ask_request.prompt,
+                        'response': response,
+                        'type': ask_request.type,
+                        'timestamp': datetime.now(),
+                        'processingTime': processing_time,
+                        'model': route['model'],
+                        'success': True
+                    })
+                except Exception as db_error:
+                    logger.error(f"Failed to save stream to history: {db_error}")
                 
                 # Send completion event
                 yield f"data: {json.dumps({
                     'type': 'complete',
                     'content': response,
+                    'routing': route,
                     'timestamp': datetime.now().isoformat()
                 })}\n\n"
                 
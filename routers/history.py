@@ -1,77 +1,144 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
-import asyncio
+from fastapi.responses import StreamingResponse
 from datetime import datetime
+from typing import Optional
+import json
 import logging
+import zlib
 
 from middleware.auth import get_current_user
-from services.firebase_service import get_firestore_client
+from middleware.rate_limit import rate_limit
+from services.history_store import history_store
+from services.search_index import history_search_index
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limit("api"))])
 
 @router.get("/")
 async def get_chat_history(
     user=Depends(get_current_user),
     limit: int = Query(50, ge=1, le=100)
 ):
-    """Get chat history for user"""
+    """Get chat history for user (index records with a response preview)"""
     try:
-        db = get_firestore_client()
-        
-        # Get chat history ordered by timestamp
-        query = db.collection('chat_history')\
-                 .where('userId', '==', user['uid'])\
-                 .order_by('timestamp', direction='DESCENDING')\
-                 .limit(limit)
-        
-        docs = await asyncio.to_thread(query.get)
-        
+        entries = await history_store.list_for_user(user['uid'], limit)
+
         history = []
-        for doc in docs:
-            data = doc.to_dict()
+        for data in entries:
             # Convert timestamp to ISO string if it exists
             if 'timestamp' in data and data['timestamp']:
                 data['timestamp'] = data['timestamp'].isoformat()
-            history.append({
-                'id': doc.id,
-                **data
-            })
-        
+            history.append(data)
+
         return {"history": history}
-        
+
     except Exception as e:
         logger.error(f"Get history error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/search")
+async def search_chat_history(
+    q: str = Query(..., min_length=1),
+    user=Depends(get_current_user),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Full-text search over the user's chat history"""
+    try:
+        return await history_search_index.search(user['uid'], q, offset, limit)
+
+    except Exception as e:
+        logger.error(f"Search history error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/export")
+async def export_chat_history(
+    user=Depends(get_current_user),
+    cursor: Optional[str] = Query(None),
+    gzip: bool = Query(False),
+    page_size: int = Query(200, ge=1, le=500)
+):
+    """Stream the user's complete chat history as NDJSON, newest first
+
+    Entries are read one page at a time, so memory stays bounded. To resume an
+    interrupted export, pass the id of the last entry received as `cursor`.
+    """
+    try:
+        # Fetch the first page up front so an invalid cursor fails with a 400
+        first_page = await history_store.page_for_user(user['uid'], page_size, cursor, include_bodies=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Export history error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def generate_export():
+        compressor = zlib.compressobj(wbits=31) if gzip else None
+        entries, next_cursor = first_page
+        count = 0
+
+        while True:
+            lines = []
+            for data in entries:
+                if 'timestamp' in data and data['timestamp']:
+                    data['timestamp'] = data['timestamp'].isoformat()
+                lines.append(json.dumps(data, default=str))
+            count += len(entries)
+
+            if lines:
+                chunk = ("\n".join(lines) + "\n").encode()
+                if compressor:
+                    # Sync flush so each page reaches the client without waiting for the end
+                    chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                yield chunk
+
+            if not next_cursor:
+                break
+            entries, next_cursor = await history_store.page_for_user(
+                user['uid'], page_size, next_cursor, include_bodies=True
+            )
+
+        if compressor:
+            yield compressor.flush()
+        logger.info(f"Exported {count} history entries for user {user['uid']}")
+
+    headers = {"Content-Disposition": "attachment; filename=chat_history.ndjson"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(generate_export(), media_type="application/x-ndjson", headers=headers)
+
+@router.get("/{history_id}")
+async def get_chat_entry(history_id: str, user=Depends(get_current_user)):
+    """Get a single chat history entry including its full response"""
+    try:
+        entry = await history_store.get(history_id)
+
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Chat entry not found")
+
+        if entry.get('userId') != user['uid']:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        if entry.get('timestamp'):
+            entry['timestamp'] = entry['timestamp'].isoformat()
+
+        return entry
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Get chat entry error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.delete("/")
 async def clear_chat_history(user=Depends(get_current_user)):
     """Clear all chat history for user"""
     try:
-        db = get_firestore_client()
-        
-        # Get all user's chat history documents
-        query = db.collection('chat_history').where('userId', '==', user['uid'])
-        docs = await asyncio.to_thread(query.get)
-        
-        # Delete all documents in batches
-        batch = db.batch()
-        count = 0
-        
-        for doc in docs:
-            batch.delete(doc.reference)
-            count += 1
-            
-            # Commit batch every 500 operations (Firestore limit)
-            if count % 500 == 0:
-                await asyncio.to_thread(batch.commit)
-                batch = db.batch()
-        
-        # Commit remaining operations
-        if count % 500 != 0:
-            await asyncio.to_thread(batch.commit)
-        
+        count = await history_store.clear_for_user(user['uid'])
+
         return {"message": f"Cleared {count} chat history entries"}
-        
+
     except Exception as e:
         logger.error(f"Clear history error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -80,26 +147,22 @@ async def clear_chat_history(user=Depends(get_current_user)):
 async def delete_chat_entry(history_id: str, user=Depends(get_current_user)):
     """Delete specific chat history entry"""
     try:
-        db = get_firestore_client()
-        
-        # Verify the document belongs to the user
-        doc_ref = db.collection('chat_history').document(history_id)
-        doc = await asyncio.to_thread(doc_ref.get)
-        
-        if not doc.exists:
+        # Verify the entry belongs to the user
+        entry = await history_store.get(history_id, include_body=False)
+
+        if entry is None:
             raise HTTPException(status_code=404, detail="Chat entry not found")
-        
-        doc_data = doc.to_dict()
-        if doc_data.get('userId') != user['uid']:
+
+        if entry.get('userId') != user['uid']:
             raise HTTPException(status_code=403, detail="Access denied")
-        
-        # Delete the document
-        await asyncio.to_thread(doc_ref.delete)
-        
+
+        # Delete the entry
+        await history_store.delete(history_id)
+
         return {"message": "Chat entry deleted successfully"}
-        
+
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Delete chat entry error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
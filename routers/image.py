@@ -1,15 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-import asyncio
 from datetime import datetime
 import logging
 
 from middleware.auth import get_current_user
+from middleware.rate_limit import rate_limit
 from services.gemini_service import gemini_service
-from services.firebase_service import get_firestore_client
+from services.model_router import model_router
+from services.usage_service import TokenBudgetExceeded
+from services.history_store import history_store
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limit("model"))])
 
 class ImageRequest(BaseModel):
     prompt: str
@@ -26,36 +28,41 @@ async def image_endpoint(image_request: ImageRequest, user=Depends(get_current_u
         processing_start = datetime.now()
         
         if image_request.imageData:
+            route = model_router.route("vision", image_request.prompt)
             # Analyze image with prompt
             response = await gemini_service.generate_from_image(
                 image_request.prompt, 
                 image_request.imageData, 
-                image_request.mimeType
+                image_request.mimeType,
+                user_id=user['uid'],
+                route=route
             )
         else:
             # Generate image-related response without actual image
+            route = model_router.route("text", image_request.prompt)
             response = await gemini_service.generate_text(
-                f"Regarding images and the following request: {image_request.prompt}"
+                f"Regarding images and the following request: {image_request.prompt}",
+                user_id=user['uid'],
+                route=route,
+                cache_prompt=image_request.prompt,
+                cache_kind="image"
             )
 
         processing_time = (datetime.now() - processing_start).total_seconds() * 1000
         
         # Save to history
         try:
-            db = get_firestore_client()
-            await asyncio.to_thread(
-                db.collection('chat_history').add,
-                {
-                    'userId': user['uid'],
-                    'prompt': image_request.prompt,
-                    'response': response,
-                    'type': 'image',
-                    'hasImage': bool(image_request.imageData),
-                    'timestamp': datetime.now(),
-                    'processingTime': processing_time,
-                    'success': True
-                }
-            )
+            await history_store.add({
+                'userId': user['uid'],
+                'prompt': image_request.prompt,
+                'response': response,
+                'type': 'image',
+                'hasImage': bool(image_request.imageData),
+                'timestamp': datetime.now(),
+                'processingTime': processing_time,
+                'model': route['model'],
+                'success': True
+            })
         except Exception as db_error:
             logger.error(f"Failed to save image request to history: {db_error}")
 
@@ -63,11 +70,14 @@ async def image_endpoint(image_request: ImageRequest, user=Depends(get_current_u
             "response": response,
             "timestamp": datetime.now().isoformat(),
             "processingTime": processing_time,
+            "routing": route,
             "success": True
         }
         
     except HTTPException:
         raise
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Image endpoint error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
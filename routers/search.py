@@ -1,16 +1,18 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-import asyncio
 from datetime import datetime
 import logging
 
 from middleware.auth import get_current_user
+from middleware.rate_limit import rate_limit
 from services.search_service import search_service
 from services.gemini_service import gemini_service
-from services.firebase_service import get_firestore_client
+from services.model_router import model_router
+from services.usage_service import TokenBudgetExceeded
+from services.history_store import history_store
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limit("model"))])
 
 class SearchRequest(BaseModel):
     query: str
@@ -27,32 +29,39 @@ async def search_endpoint(search_request: SearchRequest, user=Depends(get_curren
         
         # Generate AI response based on search results
         ai_prompt = f"Based on the following search results, provide a comprehensive answer to: \"{search_request.query}\"\n\nSearch Results:\n{search_data['context']}"
-        ai_response = await gemini_service.generate_text(ai_prompt)
+        route = model_router.route("text", ai_prompt)
+        ai_response = await gemini_service.generate_text(
+            ai_prompt,
+            user_id=user['uid'],
+            route=route,
+            cache_prompt=search_request.query,
+            cache_kind="web_search"
+        )
         
         # Save to history
         try:
-            db = get_firestore_client()
-            await asyncio.to_thread(
-                db.collection('chat_history').add,
-                {
-                    'userId': user['uid'],
-                    'prompt': search_request.query,
-                    'response': ai_response,
-                    'searchResults': search_data['results'],
-                    'type': 'search',
-                    'timestamp': datetime.now()
-                }
-            )
+            await history_store.add({
+                'userId': user['uid'],
+                'prompt': search_request.query,
+                'response': ai_response,
+                'searchResults': search_data['results'],
+                'type': 'search',
+                'model': route['model'],
+                'timestamp': datetime.now()
+            })
         except Exception as db_error:
             logger.error(f"Failed to save search to history: {db_error}")
 
         return {
             "response": ai_response,
-            "sources": search_data['results']
+            "sources": search_data['results'],
+            "routing": route
         }
         
     except HTTPException:
         raise
+    except TokenBudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         logger.error(f"Search endpoint error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
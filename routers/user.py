@@ -1,14 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-import asyncio
 from datetime import datetime
 import logging
 
 from middleware.auth import get_current_user
-from services.firebase_service import get_firestore_client
+from middleware.rate_limit import rate_limit
+from services.firebase_service import get_async_firestore_client
+from services.usage_service import usage_tracker
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(rate_limit("api"))])
 
 class UserProfile(BaseModel):
     displayName: str = None
@@ -19,10 +20,8 @@ class UserProfile(BaseModel):
 async def get_user_profile(user=Depends(get_current_user)):
     """Get user profile"""
     try:
-        db = get_firestore_client()
-        user_doc = await asyncio.to_thread(
-            db.collection('users').document(user['uid']).get
-        )
+        db = get_async_firestore_client()
+        user_doc = await db.collection('users').document(user['uid']).get()
         
         if user_doc.exists:
             profile_data = user_doc.to_dict()
@@ -45,10 +44,7 @@ async def get_user_profile(user=Depends(get_current_user)):
                 "lastActive": datetime.now()
             }
             
-            await asyncio.to_thread(
-                db.collection('users').document(user['uid']).set,
-                profile_data
-            )
+            await db.collection('users').document(user['uid']).set(profile_data)
             
             return profile_data
             
@@ -60,7 +56,7 @@ async def get_user_profile(user=Depends(get_current_user)):
 async def update_user_profile(profile: UserProfile, user=Depends(get_current_user)):
     """Update user profile"""
     try:
-        db = get_firestore_client()
+        db = get_async_firestore_client()
         
         update_data = {
             "lastActive": datetime.now()
@@ -71,13 +67,27 @@ async def update_user_profile(profile: UserProfile, user=Depends(get_current_use
         if profile.preferences:
             update_data["preferences"] = profile.preferences
             
-        await asyncio.to_thread(
-            db.collection('users').document(user['uid']).update,
-            update_data
-        )
+        await db.collection('users').document(user['uid']).update(update_data)
         
         return {"message": "Profile updated successfully"}
         
     except Exception as e:
         logger.error(f"Update profile error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/usage")
+async def get_user_usage(user=Depends(get_current_user)):
+    """Get today's token usage and daily budget"""
+    try:
+        used = await usage_tracker.get_today_tokens(user['uid'])
+        budget = usage_tracker.daily_budget
+
+        return {
+            "tokensUsed": used,
+            "dailyBudget": budget or None,
+            "remaining": max(budget - used, 0) if budget else None
+        }
+
+    except Exception as e:
+        logger.error(f"Get usage error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,10 +1,17 @@
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
 import os
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# firebase_admin and the Firestore client libraries are slow to import, so
+# they are imported on first use; the startup warmup triggers that import.
 
 def init_firebase():
     """Initialize Firebase Admin SDK"""
+    import firebase_admin
+    from firebase_admin import credentials
+
     if not firebase_admin._apps:
         service_account_info = {
             "type": "service_account",
@@ -26,8 +33,30 @@ def init_firebase():
 
 def get_firestore_client():
     """Get Firestore client"""
+    from firebase_admin import firestore
     return firestore.client()
 
+def get_async_firestore_client():
+    """Get Firestore AsyncClient (native gRPC asyncio, no thread handoff)"""
+    from firebase_admin import firestore_async
+    return firestore_async.client()
+
 def get_auth_client():
     """Get Firebase Auth client"""
-    return auth
\ No newline at end of file
+    from firebase_admin import auth
+    return auth
+
+def warm_auth_certs():
+    """Fetch the public keys used to verify ID tokens, so the first request doesn't"""
+    # verify_id_token fetches the certificates through this cached request
+    # on first use; calling it once fills the cache ahead of time. Both are
+    # firebase_admin internals, so if they change the warmup is skipped and
+    # the first verification fetches the certificates instead.
+    try:
+        from firebase_admin import _token_gen, auth
+        verifier = auth._get_client(None)._token_verifier
+        cert_uri = _token_gen.ID_TOKEN_CERT_URI
+    except (ImportError, AttributeError) as e:
+        logger.warning(f"Skipping auth certificate warmup, firebase_admin internals changed: {e}")
+        return
+    verifier.request(cert_uri, method="GET")
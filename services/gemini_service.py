@@ -1,14 +1,19 @@
-import google.generativeai as genai
 import os
 import asyncio
 import logging
-from typing import Optional
+import time
+from typing import AsyncIterator, Optional
+
+from services.key_pool import key_pool
+from services.model_router import model_router
+from services.scheduler import model_scheduler
+from services.semantic_cache import EmbeddingProvider, SemanticCache, create_embedding_provider
+from services.usage_service import usage_tracker
 
 logger = logging.getLogger(__name__)
 
 class GeminiService:
-    def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    def __init__(self, embedding_provider: Optional[EmbeddingProvider] = None):
         self.models = {
             "text": "gemini-2.0-flash-exp",
             "vision": "gemini-2.0-flash-exp",
@@ -26,48 +31,187 @@ class GeminiService:
             "base_delay": 1.0,
             "max_delay": 5.0
         }
+        self.semantic_cache = None
+        if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true":
+            self.semantic_cache = SemanticCache(
+                embedding_provider or create_embedding_provider(),
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+                capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", "1000")),
+                ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+            )
+        self.metrics = {"cancelled": 0, "abandoned": 0}
+
+    async def generate_text(
+        self,
+        prompt: str,
+        model_type: str = "text",
+        user_id: Optional[str] = None,
+        priority: Optional[str] = None,
+        route: Optional[dict] = None,
+        cache_prompt: Optional[str] = None,
+        cache_kind: Optional[str] = None
+    ) -> str:
+        """Generate text response using Gemini, reusing answers to near-duplicate prompts
+
+        `cache_prompt` is the user's own prompt when `prompt` wraps it in a
+        template, and `cache_kind` names that template. Cached answers are only
+        reused for the same user, kind and output budget.
+        """
+        route = route or model_router.route(model_type, prompt)
+        schedule = {
+            "user_id": user_id,
+            "priority": priority or ("code" if model_type == "code" else "interactive")
+        }
+        if not self.semantic_cache or not user_id:
+            await usage_tracker.check_budget(user_id)
+            return await self._execute_with_retry(self._generate_text_internal, prompt, route, **schedule)
+
+        namespace = f"{user_id}:{cache_kind or model_type}:{route['maxOutputTokens']}"
+        cached, embedding = await self.semantic_cache.lookup(cache_prompt or prompt, namespace)
+        if cached is not None:
+            return cached
+
+        await usage_tracker.check_budget(user_id)
+        response = await self._execute_with_retry(self._generate_text_internal, prompt, route, **schedule)
+        self.semantic_cache.store(namespace, embedding, response)
+        return response
+
+    async def _call_model(self, model_instance, contents, user_id: Optional[str] = None, priority: str = "interactive"):
+        """Run a model call once the scheduler grants this user a slot
+
+        A cancelled caller returns at once, but the blocking Gemini call can't
+        be interrupted: it keeps its slot until the worker thread finishes, and
+        its tokens still count toward the user's budget.
+        """
+        await model_scheduler.acquire(user_id or "anonymous", priority)
+        call = asyncio.ensure_future(self._invoke(model_instance, contents))
+
+        def finish(call: asyncio.Future) -> None:
+            model_scheduler.release()
+            if not call.cancelled() and call.exception() is None:
+                usage_tracker.record(user_id, call.result())
+
+        call.add_done_callback(finish)
+        try:
+            return await asyncio.shield(call)
+        except asyncio.CancelledError:
+            if not call.done():
+                self.metrics["abandoned"] += 1
+                logger.info("Caller went away, leaving the running model call to finish in the background")
+            raise
+
+    async def _invoke(self, model_instance, contents, stream: bool = False):
+        """Run generate_content on the next pooled API key and report the outcome"""
+        key = key_pool.bind(model_instance)
+        try:
+            response = await asyncio.to_thread(model_instance.generate_content, contents, stream=stream)
+        except Exception as e:
+            key_pool.report_error(key, e)
+            raise
+        key_pool.report_success(key)
+        return response
+
+    def _text_model(self, model: str, max_output_tokens: int = 8192):
+        import google.generativeai as genai
+
+        generation_config = {
+            "temperature": 0.7,
+            "top_k": 40,
+            "top_p": 0.95,
+            "max_output_tokens": max_output_tokens,
+        }
+        
+        safety_settings = [
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        ]
+        
+        return genai.GenerativeModel(
+            model_name=model,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
 
-    async def generate_text(self, prompt: str, model_type: str = "text") -> str:
-        """Generate text response using Gemini"""
-        return await self._execute_with_retry(self._generate_text_internal, prompt, model_type)
+    async def generate_text_stream(
+        self,
+        prompt: str,
+        model_type: str = "text",
+        user_id: Optional[str] = None,
+        route: Optional[dict] = None
+    ) -> AsyncIterator[str]:
+        """Stream text chunks from Gemini; stops reading upstream when the consumer goes away
 
-    async def _generate_text_internal(self, prompt: str, model_type: str) -> str:
-        model_name = self.models.get(model_type, self.models["text"])
+        Failures before the first chunk are retried. Once text has been sent
+        the error is raised instead, and there is no fallback model: its
+        answer would not belong to this prompt.
+        """
+        await usage_tracker.check_budget(user_id)
+        route = route or model_router.route(model_type, prompt)
+        model_instance = self._text_model(route["model"], route["maxOutputTokens"])
+        max_retries = self.retry_config["max_retries"]
+
+        for attempt in range(1, max_retries + 1):
+            start = time.perf_counter()
+            started = False
+            try:
+                async with model_scheduler.slot(user_id or "anonymous", "interactive"):
+                    response = await self._invoke(model_instance, prompt, stream=True)
+                    chunks = iter(response)
+                    try:
+                        while True:
+                            chunk = await asyncio.to_thread(next, chunks, None)
+                            if chunk is None:
+                                break
+                            if chunk.text:
+                                started = True
+                                yield chunk.text
+                    except (asyncio.CancelledError, GeneratorExit):
+                        self.metrics["cancelled"] += 1
+                        logger.info("Stream consumer went away, stopping upstream generation")
+                        # Best effort: cancel the underlying gRPC stream if the transport exposes it
+                        cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+                        if cancel:
+                            cancel()
+                        raise
+            except Exception as e:
+                model_router.record(route["model"], 0.0, success=False)
+                logger.error(f"Stream attempt {attempt} failed: {e}")
+                if started or attempt == max_retries:
+                    raise
+                # The slot is released while waiting to retry
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+
+            model_router.record(route["model"], (time.perf_counter() - start) * 1000, success=True)
+            usage_tracker.record(user_id, response)
+            return
+
+    async def _generate_text_internal(self, prompt: str, route: dict, **schedule) -> str:
+        model_name = route["model"]
         logger.info(f"Using model: {model_name} for prompt: {prompt[:50]}...")
         
-        models_to_try = [model_name] + self.models["alternatives"] + [self.models["fallback"]]
+        models_to_try = list(dict.fromkeys(
+            [model_name] + self.models["alternatives"] + [self.models["fallback"]]
+        ))
         last_error = None
         
         for model in models_to_try:
+            start = time.perf_counter()
             try:
-                generation_config = {
-                    "temperature": 0.7,
-                    "top_k": 40,
-                    "top_p": 0.95,
-                    "max_output_tokens": 8192,
-                }
-                
-                safety_settings = [
-                    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                ]
+                model_instance = self._text_model(model, route["maxOutputTokens"])
                 
-                model_instance = genai.GenerativeModel(
-                    model_name=model,
-                    generation_config=generation_config,
-                    safety_settings=safety_settings
-                )
-                
-                response = await asyncio.to_thread(model_instance.generate_content, prompt)
+                response = await self._call_model(model_instance, prompt, **schedule)
                 
                 if not response or not response.text:
                     raise Exception("Empty response from Gemini API")
                 
                 text = response.text
+                model_router.record(model, (time.perf_counter() - start) * 1000, success=True)
                 logger.info(f"Generated response length: {len(text)} using model: {model}")
                 return text
                 
             except Exception as e:
+                model_router.record(model, 0.0, success=False)
                 last_error = e
                 logger.warning(f"Model {model} failed: {e}")
                 if "not found" not in str(e) and "404" not in str(e):
@@ -75,22 +219,38 @@ class GeminiService:
         
         raise last_error
 
-    async def generate_from_image(self, prompt: str, image_data: str, mime_type: str = "image/jpeg") -> str:
+    async def generate_from_image(
+        self,
+        prompt: str,
+        image_data: str,
+        mime_type: str = "image/jpeg",
+        user_id: Optional[str] = None,
+        route: Optional[dict] = None
+    ) -> str:
         """Generate response from image using Gemini Vision"""
-        return await self._execute_with_retry(self._generate_from_image_internal, prompt, image_data, mime_type)
+        await usage_tracker.check_budget(user_id)
+        return await self._execute_with_retry(
+            self._generate_from_image_internal, prompt, image_data, mime_type,
+            route or model_router.route("vision", prompt),
+            user_id=user_id, priority="interactive"
+        )
 
-    async def _generate_from_image_internal(self, prompt: str, image_data: str, mime_type: str) -> str:
+    async def _generate_from_image_internal(
+        self, prompt: str, image_data: str, mime_type: str, route: dict, **schedule
+    ) -> str:
         logger.info(f"Generating image response for: {prompt[:50]}...")
         
         generation_config = {
             "temperature": 0.4,
             "top_k": 32,
             "top_p": 1,
-            "max_output_tokens": 4096,
+            "max_output_tokens": route["maxOutputTokens"],
         }
         
+        import google.generativeai as genai
+
         model = genai.GenerativeModel(
-            model_name=self.models["vision"],
+            model_name=route["model"],
             generation_config=generation_config
         )
         
@@ -99,14 +259,21 @@ class GeminiService:
             "data": image_data
         }
         
-        response = await asyncio.to_thread(model.generate_content, [prompt, image_part])
+        start = time.perf_counter()
+        try:
+            response = await self._call_model(model, [prompt, image_part], **schedule)
+        except Exception:
+            model_router.record(route["model"], 0.0, success=False)
+            raise
         
         if not response or not response.text:
             raise Exception("Empty response from Gemini Vision API")
         
+        model_router.record(route["model"], (time.perf_counter() - start) * 1000, success=True)
+        
         return response.text
 
-    async def generate_code(self, prompt: str) -> str:
+    async def generate_code(self, prompt: str, user_id: Optional[str] = None, route: Optional[dict] = None) -> str:
         """Generate code with enhanced prompt"""
         enhanced_prompt = f"""
 You are an expert programmer. Generate clean, well-documented, and efficient code for the following request:
@@ -121,9 +288,11 @@ Requirements:
 - Include usage examples if applicable
 
 Code:"""
-        return await self.generate_text(enhanced_prompt, "code")
+        return await self.generate_text(
+            enhanced_prompt, "code", user_id=user_id, route=route, cache_prompt=prompt, cache_kind="code"
+        )
 
-    async def generate_search(self, query: str) -> str:
+    async def generate_search(self, query: str, user_id: Optional[str] = None, route: Optional[dict] = None) -> str:
         """Generate search response"""
         search_prompt = f"""
 Provide a comprehensive answer for the search query: "{query}"
@@ -136,16 +305,32 @@ Include:
 - Recent developments if relevant
 
 Answer:"""
-        return await self.generate_text(search_prompt, "text")
+        return await self.generate_text(
+            search_prompt, "text", user_id=user_id, route=route, cache_prompt=query, cache_kind="search"
+        )
+
+    async def _execute_with_retry(self, operation, *args, **schedule):
+        """Execute operation with retry logic; cancellation abandons pending retries"""
+        try:
+            return await self._retry_loop(operation, *args, **schedule)
+        except asyncio.CancelledError:
+            self.metrics["cancelled"] += 1
+            logger.info("Generation cancelled, abandoning pending retries")
+            raise
+
+    def _retry_delay(self, attempt: int) -> float:
+        return min(
+            self.retry_config["base_delay"] * (2 ** (attempt - 1)),
+            self.retry_config["max_delay"]
+        ) + (0.1 * attempt)  # Add jitter
 
-    async def _execute_with_retry(self, operation, *args):
-        """Execute operation with retry logic"""
+    async def _retry_loop(self, operation, *args, **schedule):
         last_error = None
         
         for attempt in range(1, self.retry_config["max_retries"] + 1):
             try:
                 logger.info(f"Attempt {attempt}/{self.retry_config['max_retries']}")
-                return await operation(*args)
+                return await operation(*args, **schedule)
             except Exception as e:
                 last_error = e
                 logger.error(f"Attempt {attempt} failed: {e}")
@@ -153,11 +338,7 @@ Answer:"""
                 if attempt == self.retry_config["max_retries"]:
                     break
                 
-                delay = min(
-                    self.retry_config["base_delay"] * (2 ** (attempt - 1)),
-                    self.retry_config["max_delay"]
-                ) + (0.1 * attempt)  # Add jitter
-                
+                delay = self._retry_delay(attempt)
                 logger.info(f"Retrying in {delay:.1f}s...")
                 await asyncio.sleep(delay)
         
@@ -165,29 +346,26 @@ Answer:"""
         if "model" in str(last_error) or "not found" in str(last_error):
             logger.info("Trying fallback model...")
             try:
+                import google.generativeai as genai
+
                 model = genai.GenerativeModel(model_name=self.models["fallback"])
-                response = await asyncio.to_thread(model.generate_content, "Hello, are you working?")
+                response = await self._call_model(model, "Hello, are you working?", **schedule)
                 return response.text
             except Exception as fallback_error:
                 logger.error(f"Fallback model also failed: {fallback_error}")
         
         raise Exception(f"All attempts failed. Last error: {last_error}")
 
-    async def health_check(self) -> bool:
-        """Check if Gemini service is healthy"""
-        try:
-            response = await self.generate_text("Hello, respond with 'OK' if you are working.")
-            return "ok" in response.lower()
-        except Exception as e:
-            logger.error(f"Health check failed: {e}")
-            return False
-
     def get_model_info(self) -> dict:
         """Get model information"""
         return {
             "models": self.models,
-            "api_key_configured": bool(os.getenv("GEMINI_API_KEY")),
-            "retry_config": self.retry_config
+            "api_key_configured": bool(key_pool.keys),
+            "retry_config": self.retry_config,
+            "semantic_cache": self.semantic_cache.get_stats() if self.semantic_cache else None,
+            "scheduler": model_scheduler.get_stats(),
+            "routing": model_router.get_stats(),
+            "metrics": self.metrics
         }
 
 # Global instance
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from services.gemini_service import gemini_service
+from services.key_pool import key_pool
+from services.model_router import model_router
+
+logger = logging.getLogger(__name__)
+
+class HealthMonitor:
+    """Probes each configured model in the background and caches the result
+
+    Probes use count_tokens, which checks the key and model availability
+    without running a generation, so they cost no generation quota.
+    Health endpoints answer from the cached state. Model health is reported
+    but does not gate readiness: every instance shares the same keys, so a
+    quota error would take all of them out at once.
+    """
+
+    def __init__(self, interval: float = 30.0, timeout: float = 5.0):
+        self.interval = interval
+        self.timeout = timeout
+        self.status: Dict[str, dict] = {}
+        self.started_at = time.time()
+        self._task: Optional[asyncio.Task] = None
+
+    def configured_models(self) -> List[str]:
+        models = gemini_service.models
+        names = [models["text"], models["code"], models["vision"], models["fallback"]]
+        names += [model["name"] for model in model_router.models]
+        return list(dict.fromkeys(names))
+
+    async def probe(self, model: str) -> dict:
+        """Run one lightweight probe against a model"""
+        import google.generativeai as genai
+
+        start = time.perf_counter()
+        try:
+            model_instance = genai.GenerativeModel(model_name=model)
+            key = key_pool.bind(model_instance, "probe")
+            try:
+                await asyncio.wait_for(
+                    asyncio.to_thread(model_instance.count_tokens, "ping"),
+                    timeout=self.timeout
+                )
+            except Exception as e:
+                key_pool.report_error(key, e)
+                raise
+            key_pool.report_success(key)
+            healthy, error = True, None
+        except Exception as e:
+            healthy, error = False, str(e) or type(e).__name__
+            logger.warning(f"Health probe for {model} failed: {error}")
+
+        result = {
+            "healthy": healthy,
+            "latencyMs": round((time.perf_counter() - start) * 1000, 1),
+            "lastProbe": datetime.now().isoformat(),
+            "error": error
+        }
+        self.status[model] = result
+        return result
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self.probe(model) for model in self.configured_models()))
+
+    async def _run(self) -> None:
+        if self.status:
+            # The startup warmup already ran the first round of probes
+            await asyncio.sleep(self.interval)
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Health monitor error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def models_healthy(self) -> bool:
+        """Whether any model the router can send requests to passed its last probe"""
+        return any(
+            self.status.get(model["name"], {}).get("healthy")
+            for model in model_router.models
+        )
+
+    def get_status(self) -> dict:
+        return {
+            "modelsHealthy": self.models_healthy(),
+            "uptime": round(time.time() - self.started_at, 1),
+            "probeInterval": self.interval,
+            "models": self.status
+        }
+
+# Global instance
+health_monitor = HealthMonitor(
+    interval=float(os.getenv("HEALTH_PROBE_INTERVAL", "30")),
+    timeout=float(os.getenv("HEALTH_PROBE_TIMEOUT", "5"))
+)
@@ -0,0 +1,540 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.firebase_service import get_async_firestore_client
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Large fields stored in a separate compressed body record
+BODY_FIELDS = ('response', 'searchResults')
+PREVIEW_LENGTH = 200
+
+def split_entry(entry: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Split an entry into a small index record and its large body fields"""
+    index = {k: v for k, v in entry.items() if k not in BODY_FIELDS}
+    body = {k: entry[k] for k in BODY_FIELDS if k in entry}
+    if 'response' in body:
+        index['responsePreview'] = (body['response'] or '')[:PREVIEW_LENGTH]
+    return index, body
+
+def compress_body(body: Dict[str, Any], codec: str = "zlib") -> Tuple[str, bytes]:
+    """Serialize and compress a body; returns (codec, data)"""
+    raw = json.dumps(body, default=str).encode()
+    if codec == "zstd" and zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+def decompress_body(codec: str, data: bytes) -> Dict[str, Any]:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed history bodies")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raw = zlib.decompress(data)
+    return json.loads(raw)
+
+def build_entry(entry_id: str, data: Dict[str, Any], body: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine an index record with its body (None for index-only reads)
+
+    Entries written before bodies were split keep their body fields inline;
+    they are normalized to the same shape.
+    """
+    index, inline_body = split_entry(data)
+    entry = {'id': entry_id, **index}
+    if body is not None:
+        entry.update(body or inline_body)
+    return entry
+
+class HistoryStore:
+    """Interface for chat history persistence used by all routers
+
+    Backends implement the underscored write methods; the public wrappers
+    notify registered observers (e.g. the search index) after each change.
+    Each entry is stored as a small index record plus a compressed body holding
+    BODY_FIELDS; list and page reads return index records with a
+    `responsePreview` unless bodies are requested.
+    """
+
+    def __init__(self, body_codec: str = "zlib"):
+        self._observers = []
+        if body_codec == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed, compressing history bodies with zlib")
+            body_codec = "zlib"
+        self.body_codec = body_codec
+
+    async def warmup(self) -> None:
+        """Open backend connections ahead of the first request"""
+
+    def subscribe(self, observer) -> None:
+        """Register an observer with on_added/on_deleted/on_cleared callbacks"""
+        self._observers.append(observer)
+
+    async def add(self, entry: Dict[str, Any]) -> str:
+        """Store a history entry and return its id"""
+        entry_id = await self._add(entry)
+        for observer in self._observers:
+            observer.on_added(entry_id, entry)
+        return entry_id
+
+    async def delete(self, entry_id: str) -> None:
+        """Delete a single entry"""
+        await self._delete(entry_id)
+        for observer in self._observers:
+            observer.on_deleted(entry_id)
+
+    async def clear_for_user(self, user_id: str) -> int:
+        """Delete all of the user's entries and return how many were removed"""
+        count = await self._clear_for_user(user_id)
+        for observer in self._observers:
+            observer.on_cleared(user_id)
+        return count
+
+    async def list_for_user(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Return the index records of the user's most recent entries, newest first"""
+        raise NotImplementedError
+
+    async def page_for_user(
+        self,
+        user_id: str,
+        limit: int = 500,
+        cursor: Optional[str] = None,
+        include_bodies: bool = False,
+        since: Optional[datetime] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Return one page of entries, newest first, and the cursor for the next page
+
+        The cursor is the id of the last entry already seen, so any entry id can
+        be used to resume paging after it. Raises ValueError for an unknown cursor.
+        With `since`, only entries with a timestamp at or after it are returned.
+        """
+        raise NotImplementedError
+
+    async def existing_ids(self, entry_ids: List[str]) -> Set[str]:
+        """Return the subset of the ids that still exist"""
+        raise NotImplementedError
+
+    async def get(self, entry_id: str, include_body: bool = True) -> Optional[Dict[str, Any]]:
+        """Return a single entry or None if it does not exist"""
+        raise NotImplementedError
+
+    # Backends that keep their own full-text index set this and implement search()
+    supports_search = False
+
+    async def search(
+        self, user_id: str, terms: List[str], offset: int = 0, limit: int = 20
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """Rank the user's entries matching any of the terms; returns (matches, one page)"""
+        raise NotImplementedError
+
+    async def _add(self, entry: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    async def _delete(self, entry_id: str) -> None:
+        raise NotImplementedError
+
+    async def _clear_for_user(self, user_id: str) -> int:
+        raise NotImplementedError
+
+class FirestoreHistoryStore(HistoryStore):
+    """History store backed by Firestore
+
+    Index records live in `chat_history`; compressed bodies live in
+    `chat_history_bodies` under the same document id.
+    """
+
+    def __init__(
+        self,
+        collection: str = "chat_history",
+        body_collection: str = "chat_history_bodies",
+        body_codec: str = "zlib"
+    ):
+        super().__init__(body_codec)
+        self.collection = collection
+        self.body_collection = body_collection
+
+    def _collection(self):
+        return get_async_firestore_client().collection(self.collection)
+
+    def _bodies(self):
+        return get_async_firestore_client().collection(self.body_collection)
+
+    async def warmup(self) -> None:
+        # A one-document read opens the gRPC channel and fetches credentials
+        await self._collection().limit(1).get()
+
+    async def _load_bodies(self, entry_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not entry_ids:
+            return {}
+        refs = [self._bodies().document(entry_id) for entry_id in entry_ids]
+        bodies = {}
+        async for snapshot in get_async_firestore_client().get_all(refs):
+            if snapshot.exists:
+                data = snapshot.to_dict()
+                bodies[snapshot.id] = decompress_body(data['codec'], data['data'])
+        return bodies
+
+    async def _add(self, entry: Dict[str, Any]) -> str:
+        index, body = split_entry(entry)
+        doc_ref = self._collection().document()
+
+        batch = get_async_firestore_client().batch()
+        batch.set(doc_ref, index)
+        if body:
+            codec, data = compress_body(body, self.body_codec)
+            batch.set(self._bodies().document(doc_ref.id), {
+                'userId': entry['userId'],
+                'codec': codec,
+                'data': data
+            })
+        await batch.commit()
+        return doc_ref.id
+
+    async def list_for_user(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        query = self._collection()\
+                    .where('userId', '==', user_id)\
+                    .order_by('timestamp', direction='DESCENDING')\
+                    .limit(limit)
+        docs = await query.get()
+        return [build_entry(doc.id, doc.to_dict(), None) for doc in docs]
+
+    async def page_for_user(
+        self,
+        user_id: str,
+        limit: int = 500,
+        cursor: Optional[str] = None,
+        include_bodies: bool = False,
+        since: Optional[datetime] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query = self._collection().where('userId', '==', user_id)
+        if since is not None:
+            query = query.where('timestamp', '>=', since)
+        query = query.order_by('timestamp', direction='DESCENDING').limit(limit)
+        if cursor:
+            last_doc = await self._collection().document(cursor).get()
+            if not last_doc.exists or last_doc.get('userId') != user_id:
+                raise ValueError(f"Unknown history cursor: {cursor}")
+            query = query.start_after(last_doc)
+        docs = await query.get()
+
+        bodies = await self._load_bodies([doc.id for doc in docs]) if include_bodies else {}
+        entries = [
+            build_entry(doc.id, doc.to_dict(), bodies.get(doc.id, {}) if include_bodies else None)
+            for doc in docs
+        ]
+        next_cursor = entries[-1]['id'] if len(entries) == limit else None
+        return entries, next_cursor
+
+    async def existing_ids(self, entry_ids: List[str]) -> Set[str]:
+        if not entry_ids:
+            return set()
+        refs = [self._collection().document(entry_id) for entry_id in entry_ids]
+        existing = set()
+        # Only the index records are read, and only one small field of each
+        async for snapshot in get_async_firestore_client().get_all(refs, field_paths=['userId']):
+            if snapshot.exists:
+                existing.add(snapshot.id)
+        return existing
+
+    async def get(self, entry_id: str, include_body: bool = True) -> Optional[Dict[str, Any]]:
+        doc = await self._collection().document(entry_id).get()
+        if not doc.exists:
+            return None
+        body = (await self._load_bodies([entry_id])).get(entry_id, {}) if include_body else None
+        return build_entry(doc.id, doc.to_dict(), body)
+
+    async def _delete(self, entry_id: str) -> None:
+        batch = get_async_firestore_client().batch()
+        batch.delete(self._collection().document(entry_id))
+        batch.delete(self._bodies().document(entry_id))
+        await batch.commit()
+
+    async def _clear_for_user(self, user_id: str) -> int:
+        db = get_async_firestore_client()
+        query = self._collection().where('userId', '==', user_id)
+        docs = await query.get()
+
+        # Delete index and body documents in batches
+        batch = db.batch()
+        count = 0
+
+        for doc in docs:
+            batch.delete(doc.reference)
+            batch.delete(self._bodies().document(doc.id))
+            count += 1
+
+            # Commit batch every 500 operations (Firestore limit), two per entry
+            if count % 250 == 0:
+                await batch.commit()
+                batch = db.batch()
+
+        # Commit remaining operations
+        if count % 250 != 0:
+            await batch.commit()
+
+        return count
+
+class SQLiteHistoryStore(HistoryStore):
+    """History store backed by a local SQLite database in WAL mode
+
+    Prompts and responses are also indexed in an FTS5 table written in the
+    same transaction as the entry, so search results are never stale, even
+    with several worker processes sharing the database.
+    """
+
+    ENTRY_COLUMNS = "h.id, h.userId, h.timestamp, h.data"
+    BODY_COLUMNS = "b.codec, b.data"
+    supports_search = True
+
+    def __init__(self, path: str, body_codec: str = "zlib"):
+        super().__init__(body_codec)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id TEXT PRIMARY KEY,
+                userId TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts "
+            "ON chat_history (userId, timestamp DESC, id DESC)"
+        )
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS history_bodies (
+                id TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL
+            )
+        """)
+        has_fts = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'chat_history_fts'"
+        ).fetchone()
+        # The owner column holds the hex-encoded uid: FTS5 matching is case-insensitive
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts "
+            "USING fts5(id UNINDEXED, owner, prompt, response)"
+        )
+        if not has_fts:
+            self._backfill_fts()
+        logger.info(f"SQLite history store opened at {path}")
+
+    @staticmethod
+    def _fts_row(entry_id: str, user_id: str, entry: Dict[str, Any]) -> tuple:
+        return (entry_id, user_id.encode().hex(), entry.get('prompt') or '', entry.get('response') or '')
+
+    def _backfill_fts(self) -> None:
+        rows = self._execute(self._select(True))
+        if not rows:
+            return
+        self._write([
+            (
+                "INSERT INTO chat_history_fts (id, owner, prompt, response) VALUES (?, ?, ?, ?)",
+                self._fts_row(row[0], row[1], self._row_to_entry(row))
+            )
+            for row in rows
+        ])
+        logger.info(f"Indexed {len(rows)} existing history entries for search")
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, statements: List[Tuple[str, tuple]]) -> int:
+        """Run write statements in one transaction; returns the last rowcount"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                rowcount = 0
+                for sql, params in statements:
+                    rowcount = self._conn.execute(sql, params).rowcount
+                self._conn.execute("COMMIT")
+                return rowcount
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _row_to_entry(self, row: tuple) -> Dict[str, Any]:
+        entry_id, user_id, timestamp, data = row[:4]
+        body = None
+        if len(row) > 4:
+            codec, body_data = row[4:]
+            body = decompress_body(codec, body_data) if body_data is not None else {}
+
+        index = json.loads(data)
+        index['userId'] = user_id
+        index['timestamp'] = datetime.fromtimestamp(timestamp)
+        return build_entry(entry_id, index, body)
+
+    def _select(self, include_bodies: bool) -> str:
+        if include_bodies:
+            return (f"SELECT {self.ENTRY_COLUMNS}, {self.BODY_COLUMNS} FROM chat_history h "
+                    "LEFT JOIN history_bodies b ON b.id = h.id ")
+        return f"SELECT {self.ENTRY_COLUMNS} FROM chat_history h "
+
+    def _add_sync(self, entry: Dict[str, Any]) -> str:
+        entry_id = uuid.uuid4().hex
+        index, body = split_entry(entry)
+        data = {k: v for k, v in index.items() if k not in ('userId', 'timestamp')}
+        timestamp = entry.get('timestamp') or datetime.now()
+
+        statements = [(
+            "INSERT INTO chat_history (id, userId, timestamp, data) VALUES (?, ?, ?, ?)",
+            (entry_id, entry['userId'], timestamp.timestamp(), json.dumps(data, default=str))
+        ), (
+            "INSERT INTO chat_history_fts (id, owner, prompt, response) VALUES (?, ?, ?, ?)",
+            self._fts_row(entry_id, entry['userId'], entry)
+        )]
+        if body:
+            codec, blob = compress_body(body, self.body_codec)
+            statements.append((
+                "INSERT INTO history_bodies (id, codec, data) VALUES (?, ?, ?)",
+                (entry_id, codec, blob)
+            ))
+        self._write(statements)
+        return entry_id
+
+    async def _add(self, entry: Dict[str, Any]) -> str:
+        return await asyncio.to_thread(self._add_sync, entry)
+
+    async def list_for_user(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            self._select(False) + "WHERE h.userId = ? ORDER BY h.timestamp DESC LIMIT ?",
+            (user_id, limit)
+        )
+        return [self._row_to_entry(row) for row in rows]
+
+    async def page_for_user(
+        self,
+        user_id: str,
+        limit: int = 500,
+        cursor: Optional[str] = None,
+        include_bodies: bool = False,
+        since: Optional[datetime] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        min_ts = since.timestamp() if since is not None else float('-inf')
+        if cursor:
+            last = await asyncio.to_thread(
+                self._execute,
+                "SELECT timestamp FROM chat_history WHERE id = ? AND userId = ?",
+                (cursor, user_id)
+            )
+            if not last:
+                raise ValueError(f"Unknown history cursor: {cursor}")
+            last_ts = last[0][0]
+            rows = await asyncio.to_thread(
+                self._execute,
+                self._select(include_bodies) +
+                "WHERE h.userId = ? AND h.timestamp >= ? "
+                "AND (h.timestamp < ? OR (h.timestamp = ? AND h.id < ?)) "
+                "ORDER BY h.timestamp DESC, h.id DESC LIMIT ?",
+                (user_id, min_ts, last_ts, last_ts, cursor, limit)
+            )
+        else:
+            rows = await asyncio.to_thread(
+                self._execute,
+                self._select(include_bodies) +
+                "WHERE h.userId = ? AND h.timestamp >= ? ORDER BY h.timestamp DESC, h.id DESC LIMIT ?",
+                (user_id, min_ts, limit)
+            )
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return [self._row_to_entry(row) for row in rows], next_cursor
+
+    async def existing_ids(self, entry_ids: List[str]) -> Set[str]:
+        if not entry_ids:
+            return set()
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT id FROM chat_history WHERE id IN ({', '.join('?' * len(entry_ids))})",
+            tuple(entry_ids)
+        )
+        return {row[0] for row in rows}
+
+    async def get(self, entry_id: str, include_body: bool = True) -> Optional[Dict[str, Any]]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            self._select(include_body) + "WHERE h.id = ?",
+            (entry_id,)
+        )
+        return self._row_to_entry(rows[0]) if rows else None
+
+    async def _delete(self, entry_id: str) -> None:
+        await asyncio.to_thread(self._write, [
+            ("DELETE FROM chat_history_fts WHERE id = ?", (entry_id,)),
+            ("DELETE FROM history_bodies WHERE id = ?", (entry_id,)),
+            ("DELETE FROM chat_history WHERE id = ?", (entry_id,))
+        ])
+
+    async def _clear_for_user(self, user_id: str) -> int:
+        return await asyncio.to_thread(self._write, [
+            ("DELETE FROM chat_history_fts WHERE owner MATCH ?", (f'"{user_id.encode().hex()}"',)),
+            ("DELETE FROM history_bodies WHERE id IN (SELECT id FROM chat_history WHERE userId = ?)", (user_id,)),
+            ("DELETE FROM chat_history WHERE userId = ?", (user_id,))
+        ])
+
+    async def search(
+        self, user_id: str, terms: List[str], offset: int = 0, limit: int = 20
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        if not terms:
+            return 0, []
+        # Quoted terms are matched literally; any term may match, as in BM25
+        match = f'owner:"{user_id.encode().hex()}" AND (' + " OR ".join(
+            '"' + term.replace('"', '""') + '"' for term in dict.fromkeys(terms)
+        ) + ")"
+
+        total = await asyncio.to_thread(
+            self._execute, "SELECT COUNT(*) FROM chat_history_fts WHERE chat_history_fts MATCH ?", (match,)
+        )
+        # bm25() is lower for better matches; the id and owner columns carry no weight
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT f.id, -bm25(chat_history_fts, 0.0, 0.0, 1.0, 1.0) AS score, "
+            f"substr(f.prompt, 1, {PREVIEW_LENGTH}), substr(f.response, 1, {PREVIEW_LENGTH}), "
+            "h.timestamp, h.data "
+            "FROM chat_history_fts f JOIN chat_history h ON h.id = f.id "
+            "WHERE chat_history_fts MATCH ? ORDER BY score DESC, h.timestamp DESC LIMIT ? OFFSET ?",
+            (match, limit, offset)
+        )
+        results = [
+            {
+                'id': entry_id,
+                'score': score,
+                'prompt': prompt,
+                'response': response,
+                'type': json.loads(data).get('type'),
+                'timestamp': datetime.fromtimestamp(timestamp)
+            }
+            for entry_id, score, prompt, response, timestamp, data in rows
+        ]
+        return total[0][0], results
+
+def create_history_store() -> HistoryStore:
+    """Create the history store selected by HISTORY_BACKEND"""
+    backend = os.getenv("HISTORY_BACKEND", "firestore").lower()
+    body_codec = os.getenv("HISTORY_BODY_CODEC", "zlib").lower()
+    if backend == "sqlite":
+        return SQLiteHistoryStore(os.getenv("HISTORY_DB_PATH", "history.db"), body_codec)
+    if backend != "firestore":
+        logger.warning(f"Unknown HISTORY_BACKEND '{backend}', using firestore")
+    return FirestoreHistoryStore(body_codec=body_codec)
+
+# Global instance
+history_store = create_history_store()
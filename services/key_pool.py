@@ -0,0 +1,140 @@
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUOTA_ERROR_MARKERS = ("429", "quota", "resource exhausted", "resourceexhausted", "rate limit")
+
+# What a call is for; each purpose has its own request window per key, so
+# health probes and embeddings don't use up the generation budget
+PURPOSES = ("generate", "embed", "probe")
+
+class ApiKey:
+    """One Gemini API key with its request windows and cooldown state"""
+
+    def __init__(self, key: str, index: int = 0):
+        self.key = key
+        # Labelled by position, so stats and logs never show part of the key
+        self.name = f"key-{index}"
+        self.requests = {purpose: 0 for purpose in PURPOSES}
+        self.errors = 0
+        self.quota_errors = 0
+        self.windows: Dict[str, deque] = {purpose: deque() for purpose in PURPOSES}
+        self.cooldown_until = 0.0
+        self.cooldown = 0.0
+
+    def used_in_window(self, now: float, purpose: str = "generate") -> int:
+        window = self.windows[purpose]
+        while window and window[0] <= now - 60:
+            window.popleft()
+        return len(window)
+
+class KeyPool:
+    """Spreads Gemini calls over several API keys
+
+    Each call goes to the key with the most headroom left in its per-minute
+    request budget for the call's purpose; `rpm_limit` is the generation
+    budget. A key that hits a quota error cools down, with exponential
+    backoff, until it is given traffic again.
+    """
+
+    def __init__(
+        self,
+        keys: List[str],
+        rpm_limit: int = 15,
+        base_cooldown: float = 30.0,
+        max_cooldown: float = 600.0
+    ):
+        self.keys = [ApiKey(key, index) for index, key in enumerate(keys)]
+        self.rpm_limit = rpm_limit
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self._clients: Dict[str, Any] = {}
+
+    def acquire(self, purpose: str = "generate") -> Optional[ApiKey]:
+        """Pick the key for the next call and count the request against it"""
+        if not self.keys:
+            return None
+
+        now = time.time()
+        available = [key for key in self.keys if key.cooldown_until <= now]
+        if available:
+            key = min(available, key=lambda k: k.used_in_window(now, purpose))
+        else:
+            # Every key is cooling down; use the one that recovers first
+            key = min(self.keys, key=lambda k: k.cooldown_until)
+
+        key.requests[purpose] += 1
+        key.windows[purpose].append(now)
+        return key
+
+    def client(self, key: Optional[ApiKey]):
+        """Generative service client bound to the key (None: the global default)"""
+        if key is None:
+            return None
+        if key.key not in self._clients:
+            from google.generativeai import client as genai_client
+
+            manager = genai_client._ClientManager()
+            manager.configure(api_key=key.key)
+            self._clients[key.key] = manager.get_default_client("generative")
+        return self._clients[key.key]
+
+    def warm(self) -> None:
+        """Create the client for every key up front"""
+        for key in self.keys:
+            self.client(key)
+
+    def bind(self, model_instance, purpose: str = "generate") -> Optional[ApiKey]:
+        """Point a GenerativeModel at the next key and return that key"""
+        key = self.acquire(purpose)
+        if key is not None:
+            # GenerativeModel lazily creates its client from the global config;
+            # setting it up front routes this instance's calls through the key
+            model_instance._client = self.client(key)
+        return key
+
+    def report_success(self, key: Optional[ApiKey]) -> None:
+        if key is not None:
+            key.cooldown = 0.0
+
+    def report_error(self, key: Optional[ApiKey], error: Exception) -> None:
+        if key is None:
+            return
+
+        key.errors += 1
+        message = f"{type(error).__name__} {error}".lower()
+        if any(marker in message for marker in QUOTA_ERROR_MARKERS):
+            key.quota_errors += 1
+            key.cooldown = min(max(key.cooldown * 2, self.base_cooldown), self.max_cooldown)
+            key.cooldown_until = time.time() + key.cooldown
+            logger.warning(f"API key {key.name} hit its quota, cooling down for {key.cooldown:.0f}s")
+
+    def get_stats(self) -> List[dict]:
+        now = time.time()
+        return [
+            {
+                "key": key.name,
+                "requests": key.requests,
+                "errors": key.errors,
+                "quotaErrors": key.quota_errors,
+                "requestsLastMinute": {purpose: key.used_in_window(now, purpose) for purpose in PURPOSES},
+                "generateHeadroom": max(self.rpm_limit - key.used_in_window(now), 0),
+                "coolingDown": key.cooldown_until > now,
+                "cooldownRemaining": round(max(key.cooldown_until - now, 0.0), 1)
+            }
+            for key in self.keys
+        ]
+
+def load_api_keys() -> List[str]:
+    """Keys from GEMINI_API_KEYS (comma-separated), falling back to GEMINI_API_KEY"""
+    keys = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+    if not keys and os.getenv("GEMINI_API_KEY"):
+        keys = [os.getenv("GEMINI_API_KEY")]
+    return keys
+
+# Global instance
+key_pool = KeyPool(load_api_keys(), rpm_limit=int(os.getenv("GEMINI_KEY_RPM", "15")))
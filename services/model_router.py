@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "models": [
+        {"name": "gemini-2.0-flash-exp", "types": ["text", "code", "vision"], "maxOutputTokens": 8192}
+    ],
+    "outputBudgets": {}
+}
+
+class ModelRouter:
+    """Picks the model and output budget for each request
+
+    Candidates come from the model config file. Each model's latency and error
+    rate are tracked as exponentially weighted moving averages, and the router
+    prefers the model with the lowest error-penalised latency. Error rates decay
+    with `error_half_life` seconds so a recovered model is tried again. Output
+    budgets are chosen from the request type and prompt length.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        alpha: float = 0.2,
+        error_penalty: float = 4.0,
+        error_half_life: float = 60.0
+    ):
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.error_half_life = error_half_life
+        self.models: List[dict] = config.get("models") or DEFAULT_CONFIG["models"]
+        self.output_budgets: Dict[str, List[dict]] = config.get("outputBudgets", {})
+        self.stats: Dict[str, dict] = {
+            model["name"]: {
+                "latencyMs": float(model.get("expectedLatencyMs", 2000)),
+                "errorRate": 0.0,
+                "errorUpdated": 0.0,
+                "requests": 0
+            }
+            for model in self.models
+        }
+
+    def _candidates(self, model_type: str) -> List[dict]:
+        candidates = [m for m in self.models if model_type in m.get("types", ["text"])]
+        return candidates or [m for m in self.models if "text" in m.get("types", ["text"])] or self.models
+
+    def _error_rate(self, model_name: str) -> float:
+        stats = self.stats[model_name]
+        elapsed = time.time() - stats["errorUpdated"]
+        return stats["errorRate"] * 0.5 ** (elapsed / self.error_half_life)
+
+    def _score(self, model_name: str) -> float:
+        return self.stats[model_name]["latencyMs"] * (1 + self.error_penalty * self._error_rate(model_name))
+
+    def _output_budget(self, model_type: str, prompt: str, model: dict) -> int:
+        limit = model.get("maxOutputTokens", 8192)
+        for rule in self.output_budgets.get(model_type, []):
+            if len(prompt) <= rule.get("maxPromptChars", float("inf")):
+                return min(rule["maxOutputTokens"], limit)
+        return limit
+
+    def route(self, model_type: str, prompt: str) -> dict:
+        """Return the routing decision for one request"""
+        candidates = self._candidates(model_type)
+        # Ties keep config order, so the first listed model is preferred
+        model = min(candidates, key=lambda m: self._score(m["name"]))
+        stats = self.stats[model["name"]]
+
+        return {
+            "model": model["name"],
+            "maxOutputTokens": self._output_budget(model_type, prompt, model),
+            "type": model_type,
+            "promptChars": len(prompt),
+            "expectedLatencyMs": round(stats["latencyMs"], 1),
+            "errorRate": round(self._error_rate(model["name"]), 3)
+        }
+
+    def record(self, model_name: str, latency_ms: float, success: bool) -> None:
+        """Feed one observed call into the model's moving averages"""
+        stats = self.stats.get(model_name)
+        if stats is None:
+            return
+
+        stats["requests"] += 1
+        error_rate = self._error_rate(model_name)
+        stats["errorRate"] = error_rate + self.alpha * ((0.0 if success else 1.0) - error_rate)
+        stats["errorUpdated"] = time.time()
+        if success:
+            stats["latencyMs"] += self.alpha * (latency_ms - stats["latencyMs"])
+
+    def get_stats(self) -> dict:
+        return {
+            name: {
+                "latencyMs": round(stats["latencyMs"], 1),
+                "errorRate": round(self._error_rate(name), 3),
+                "requests": stats["requests"]
+            }
+            for name, stats in self.stats.items()
+        }
+
+def load_model_config(path: Optional[str] = None) -> dict:
+    """Load the model config file, falling back to the built-in default"""
+    path = path or os.getenv("MODEL_CONFIG_PATH") or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models.json"
+    )
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.warning(f"Model config {path} not found, using default model")
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid model config {path}: {e}, using default model")
+    return DEFAULT_CONFIG
+
+# Global instance
+model_router = ModelRouter(load_model_config())
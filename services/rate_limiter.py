@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, NamedTuple, Tuple
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+PERIOD_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float
+
+def parse_limit(limit: str) -> Tuple[int, float]:
+    """Parse "100/15minutes" into (capacity, period in seconds)"""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*", limit)
+    if not match:
+        raise ValueError(f"Invalid rate limit '{limit}'")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIOD_SECONDS[unit]
+
+def take_token(tokens: float, elapsed: float, capacity: int, period: float, cost: float) -> Tuple[float, RateLimitResult]:
+    """Refill a bucket for the elapsed time and try to take `cost` tokens from it"""
+    rate = capacity / period
+    tokens = min(capacity, tokens + elapsed * rate)
+    if tokens >= cost:
+        tokens -= cost
+        return tokens, RateLimitResult(True, int(tokens), 0.0)
+    return tokens, RateLimitResult(False, int(tokens), (cost - tokens) / rate)
+
+class RateLimitStore:
+    """Shared storage for token buckets, so every worker sees the same limits"""
+
+    async def take(self, key: str, capacity: int, period: float, cost: float = 1) -> RateLimitResult:
+        raise NotImplementedError
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """Token buckets in a SQLite file shared by all worker processes on the host
+
+    Each take runs in a BEGIN IMMEDIATE transaction, which holds the database
+    write lock, so concurrent workers update a bucket one at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+        self._takes = 0
+        logger.info(f"SQLite rate limit store opened at {path}")
+
+    def _take_sync(self, key: str, capacity: int, period: float, cost: float) -> RateLimitResult:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens, result = take_token(tokens, max(now - updated, 0.0), capacity, period, cost)
+                # A bucket that has refilled completely is the same as no bucket
+                expires = now + (capacity - tokens) * period / capacity
+                self._conn.execute(
+                    "INSERT INTO rate_limit_buckets (key, tokens, updated, expires) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, "
+                    "updated = excluded.updated, expires = excluded.expires",
+                    (key, tokens, now, expires)
+                )
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    self._conn.execute("DELETE FROM rate_limit_buckets WHERE expires < ?", (now,))
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def take(self, key: str, capacity: int, period: float, cost: float = 1) -> RateLimitResult:
+        return await asyncio.to_thread(self._take_sync, key, capacity, period, cost)
+
+class RedisRateLimitStore(RateLimitStore):
+    """Token buckets in Redis, shared by workers across instances
+
+    The bucket update runs as a Lua script, so it is atomic on the server and
+    uses the Redis clock rather than each instance's own.
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local period = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local rate = capacity / period
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+    local allowed = 0
+    local retry_after = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    else
+        retry_after = (cost - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+    return {allowed, math.floor(tokens), tostring(retry_after)}
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+        logger.info("Redis rate limit store configured")
+
+    async def take(self, key: str, capacity: int, period: float, cost: float = 1) -> RateLimitResult:
+        allowed, remaining, retry_after = await self._script(
+            keys=[f"{self.prefix}{key}"], args=[capacity, period, cost]
+        )
+        return RateLimitResult(bool(allowed), int(remaining), float(retry_after))
+
+class RateLimiter:
+    """Per-user token bucket limits, grouped into named scopes
+
+    Each scope has a "count/period" limit such as "100/15minutes": a bucket
+    holds up to `count` tokens and refills at count/period tokens per second.
+    A user's requests in one scope share a bucket across all workers.
+    """
+
+    def __init__(self, store: RateLimitStore, limits: Dict[str, str]):
+        self.store = store
+        self.limits = {scope: parse_limit(limit) for scope, limit in limits.items()}
+
+    async def hit(self, scope: str, key: str, cost: float = 1) -> RateLimitResult:
+        """Take `cost` tokens from the key's bucket in the scope"""
+        capacity, period = self.limits[scope]
+        return await self.store.take(f"{scope}:{key}", capacity, period, cost)
+
+    def capacity(self, scope: str) -> int:
+        return self.limits[scope][0]
+
+def create_rate_limit_store() -> RateLimitStore:
+    """Create the rate limit store selected by RATE_LIMIT_BACKEND"""
+    backend = os.getenv("RATE_LIMIT_BACKEND", "sqlite").lower()
+    if backend == "redis":
+        if redis is not None:
+            return RedisRateLimitStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        logger.warning("redis is not installed, using the SQLite rate limit store")
+    elif backend != "sqlite":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{backend}', using sqlite")
+    return SQLiteRateLimitStore(os.getenv("RATE_LIMIT_DB_PATH", "ratelimit.db"))
+
+# Global instance
+rate_limiter = RateLimiter(
+    create_rate_limit_store(),
+    {
+        "model": os.getenv("RATE_LIMIT_MODEL", "100/15minutes"),
+        "api": os.getenv("RATE_LIMIT_API", "300/15minutes")
+    }
+)
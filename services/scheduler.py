@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Highest priority first; lower classes run when no higher class is waiting,
+# or when their oldest call has waited longer than the scheduler's max_wait
+PRIORITY_CLASSES = ("interactive", "code", "batch")
+
+class _Waiter:
+    __slots__ = ("future", "cost", "enqueued")
+
+    def __init__(self, cost: float):
+        self.future = asyncio.get_running_loop().create_future()
+        self.cost = cost
+        self.enqueued = time.perf_counter()
+
+class FairScheduler:
+    """Limits concurrent model calls and fair-queues waiting work per user
+
+    Within a priority class users are served by deficit round-robin, so a
+    single user with many queued calls gets the same share of slots as a
+    user with one. Classes are served in priority order, except that a class
+    whose oldest call has waited `max_wait` seconds goes first, so steady
+    interactive load cannot starve code and batch work. Wait statistics are
+    kept for the `max_tracked_users` most recently active users.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        quantum: float = 1.0,
+        max_wait: float = 10.0,
+        max_tracked_users: int = 10000
+    ):
+        self.max_concurrency = max_concurrency
+        self.quantum = quantum
+        self.max_wait = max_wait
+        self.max_tracked_users = max_tracked_users
+        self._active = 0
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in PRIORITY_CLASSES
+        }
+        self._deficits: Dict[str, Dict[str, float]] = {priority: {} for priority in PRIORITY_CLASSES}
+        self._wait_stats: "OrderedDict[str, dict]" = OrderedDict()
+
+    @asynccontextmanager
+    async def slot(self, user_id: str, priority: str = "interactive", cost: float = 1.0):
+        """Hold one model-call slot for the duration of the block"""
+        await self.acquire(user_id, priority, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id: str, priority: str = "interactive", cost: float = 1.0) -> None:
+        """Wait for a model-call slot; it is held until release() is called"""
+        if priority not in self._queues:
+            priority = "interactive"
+        await self._acquire(user_id, priority, cost)
+
+    def release(self) -> None:
+        self._release()
+
+    async def _acquire(self, user_id: str, priority: str, cost: float) -> None:
+        if self._active < self.max_concurrency and not self.queued():
+            self._active += 1
+            self._record_wait(user_id, 0.0)
+            return
+
+        waiter = _Waiter(cost)
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Slot was granted just before cancellation; hand it back
+                self._release()
+            else:
+                self._remove(priority, user_id, waiter)
+            raise
+
+        self._record_wait(user_id, (time.perf_counter() - waiter.enqueued) * 1000)
+
+    def _release(self) -> None:
+        self._active -= 1
+        self._dispatch()
+
+    def _remove(self, priority: str, user_id: str, waiter: _Waiter) -> None:
+        queue = self._queues[priority].get(user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[priority][user_id]
+                self._deficits[priority].pop(user_id, None)
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def _oldest_wait(self, priority: str, now: float) -> float:
+        users = self._queues[priority]
+        return max((now - queue[0].enqueued for queue in users.values()), default=0.0)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        now = time.perf_counter()
+        starved = [p for p in PRIORITY_CLASSES[1:] if self._oldest_wait(p, now) >= self.max_wait]
+        for priority in starved + list(PRIORITY_CLASSES):
+            waiter = self._next_in_class(priority)
+            if waiter is not None:
+                return waiter
+        return None
+
+    def _next_in_class(self, priority: str) -> Optional[_Waiter]:
+        users = self._queues[priority]
+        deficits = self._deficits[priority]
+
+        while users:
+            user_id, queue = next(iter(users.items()))
+            head = queue[0]
+            if deficits.get(user_id, 0.0) < head.cost:
+                # Top up and move to the back of the round
+                deficits[user_id] = deficits.get(user_id, 0.0) + self.quantum
+                users.move_to_end(user_id)
+                continue
+
+            queue.popleft()
+            deficits[user_id] -= head.cost
+            if not queue:
+                del users[user_id]
+                deficits.pop(user_id, None)
+            return head
+
+        return None
+
+    def _record_wait(self, user_id: str, wait_ms: float) -> None:
+        stats = self._wait_stats.setdefault(
+            user_id, {"requests": 0, "totalWaitMs": 0.0, "maxWaitMs": 0.0, "lastWaitMs": 0.0}
+        )
+        self._wait_stats.move_to_end(user_id)
+        while len(self._wait_stats) > self.max_tracked_users:
+            self._wait_stats.popitem(last=False)
+        stats["requests"] += 1
+        stats["totalWaitMs"] += wait_ms
+        stats["maxWaitMs"] = max(stats["maxWaitMs"], wait_ms)
+        stats["lastWaitMs"] = wait_ms
+
+    def queued(self) -> int:
+        return sum(len(q) for users in self._queues.values() for q in users.values())
+
+    def get_user_stats(self, user_id: str) -> dict:
+        """Queue wait statistics for one user"""
+        stats = self._wait_stats.get(user_id)
+        if not stats:
+            return {"requests": 0, "avgWaitMs": 0.0, "maxWaitMs": 0.0, "lastWaitMs": 0.0, "queued": 0}
+
+        return {
+            "requests": stats["requests"],
+            "avgWaitMs": round(stats["totalWaitMs"] / stats["requests"], 2),
+            "maxWaitMs": round(stats["maxWaitMs"], 2),
+            "lastWaitMs": round(stats["lastWaitMs"], 2),
+            "queued": sum(len(users.get(user_id, ())) for users in self._queues.values())
+        }
+
+    def get_stats(self) -> dict:
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "active": self._active,
+            "queued": {
+                priority: sum(len(q) for q in users.values())
+                for priority, users in self._queues.items()
+            }
+        }
+
+# Global instance
+model_scheduler = FairScheduler(
+    max_concurrency=int(os.getenv("MODEL_MAX_CONCURRENCY", "8")),
+    max_wait=float(os.getenv("MODEL_QUEUE_MAX_WAIT", "10"))
+)
@@ -0,0 +1,275 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.history_store import HistoryStore, history_store
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "was", "with"
+}
+PREVIEW_LENGTH = 200
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+class _UserIndex:
+    """Inverted index over a single user's history entries"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.previews: Dict[str, Dict[str, Any]] = {}
+        self.total_length = 0
+        self.ready = False
+        self.refreshed_at = 0.0
+        # Timestamp of the newest entry read from the store, as the store returned it
+        self.newest = None
+        # Ids deleted while the initial build was running
+        self.tombstones: Set[str] = set()
+
+    def add(self, entry_id: str, entry: Dict[str, Any]) -> None:
+        if entry_id in self.doc_lengths or entry_id in self.tombstones:
+            return
+
+        tokens = tokenize(f"{entry.get('prompt', '')} {entry.get('response', '')}")
+        for token in tokens:
+            doc_tf = self.postings.setdefault(token, {})
+            doc_tf[entry_id] = doc_tf.get(entry_id, 0) + 1
+
+        self.doc_lengths[entry_id] = len(tokens)
+        self.doc_terms[entry_id] = list(set(tokens))
+        self.total_length += len(tokens)
+        timestamp = entry.get('timestamp')
+        self.previews[entry_id] = {
+            'prompt': (entry.get('prompt') or '')[:PREVIEW_LENGTH],
+            'response': (entry.get('response') or '')[:PREVIEW_LENGTH],
+            'type': entry.get('type'),
+            'timestamp': timestamp.timestamp() if hasattr(timestamp, 'timestamp') else 0.0
+        }
+
+    def remove(self, entry_id: str) -> None:
+        if not self.ready:
+            self.tombstones.add(entry_id)
+
+        length = self.doc_lengths.pop(entry_id, None)
+        if length is None:
+            return
+
+        self.total_length -= length
+        self.previews.pop(entry_id, None)
+        for token in self.doc_terms.pop(entry_id, []):
+            del self.postings[token][entry_id]
+            if not self.postings[token]:
+                del self.postings[token]
+
+    def search(self, terms: List[str], top_n: int, k1: float = 1.2, b: float = 0.75) -> Tuple[int, List[tuple]]:
+        """Rank documents with BM25, ties broken by recency; returns (matches, top_n results)"""
+        doc_count = len(self.doc_lengths)
+        if not doc_count:
+            return 0, []
+
+        avg_length = self.total_length / doc_count or 1.0
+        scores: Dict[str, float] = {}
+
+        for term in set(terms):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for entry_id, tf in docs.items():
+                norm = k1 * (1 - b + b * self.doc_lengths[entry_id] / avg_length)
+                scores[entry_id] = scores.get(entry_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(
+            top_n,
+            scores.items(),
+            key=lambda item: (item[1], self.previews[item[0]]['timestamp'])
+        )
+        return len(scores), top
+
+class HistorySearchIndex:
+    """Per-user full-text index over chat history, kept in sync with the history store
+
+    A user's index is built from the store on their first search and then
+    maintained incrementally from store writes and deletes. Writes made by
+    other worker processes or instances are not seen, so once an index is
+    older than `max_age` seconds the next search first reads the entries added
+    since its newest one; entries deleted elsewhere are dropped when a search
+    result turns out to no longer exist. The least recently searched users are
+    evicted once `max_users` indexes are held in memory.
+
+    Stores that keep their own full-text index (SQLite FTS5) are searched
+    directly instead.
+    """
+
+    def __init__(self, store: HistoryStore, max_users: int = 500, max_age: float = 120.0):
+        self.store = store
+        self.max_users = max_users
+        self.max_age = max_age
+        self._users: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._owners: Dict[str, str] = {}
+        self._build_locks: Dict[str, asyncio.Lock] = {}
+        store.subscribe(self)
+
+    # History store observer callbacks
+
+    def on_added(self, entry_id: str, entry: Dict[str, Any]) -> None:
+        index = self._users.get(entry.get('userId'))
+        if index is not None:
+            index.add(entry_id, entry)
+            self._owners[entry_id] = entry['userId']
+
+    def on_deleted(self, entry_id: str) -> None:
+        user_id = self._owners.pop(entry_id, None)
+        if user_id is not None and user_id in self._users:
+            self._users[user_id].remove(entry_id)
+            return
+
+        # Unknown owner: only indexes that are still building can be affected
+        for index in self._users.values():
+            if not index.ready:
+                index.tombstones.add(entry_id)
+
+    def on_cleared(self, user_id: str) -> None:
+        index = self._users.pop(user_id, None)
+        if index is not None:
+            for entry_id in index.doc_lengths:
+                self._owners.pop(entry_id, None)
+
+    def _is_fresh(self, index: Optional[_UserIndex]) -> bool:
+        return index is not None and index.ready and time.monotonic() - index.refreshed_at < self.max_age
+
+    async def _get_user_index(self, user_id: str) -> _UserIndex:
+        index = self._users.get(user_id)
+        if self._is_fresh(index):
+            self._users.move_to_end(user_id)
+            return index
+
+        lock = self._build_locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                index = self._users.get(user_id)
+                if self._is_fresh(index):
+                    return index
+                if index is not None and index.ready:
+                    await self._refresh(user_id, index)
+                    self._users.move_to_end(user_id)
+                    return index
+                return await self._build(user_id)
+        finally:
+            if not lock.locked():
+                self._build_locks.pop(user_id, None)
+
+    async def _load(self, user_id: str, index: _UserIndex, since: Optional[datetime] = None) -> None:
+        """Add the user's entries from the store, newest first, to the index"""
+        cursor = None
+        while True:
+            entries, cursor = await self.store.page_for_user(
+                user_id, 500, cursor, include_bodies=True, since=since
+            )
+            if entries and (index.newest is None or entries[0]['timestamp'] > index.newest):
+                index.newest = entries[0]['timestamp']
+            for entry in entries:
+                index.add(entry['id'], entry)
+                self._owners[entry['id']] = user_id
+            if not cursor:
+                break
+
+    async def _build(self, user_id: str) -> _UserIndex:
+        # Register before loading so concurrent writes are captured
+        index = _UserIndex()
+        self._users[user_id] = index
+        try:
+            await self._load(user_id, index)
+        except Exception:
+            self._users.pop(user_id, None)
+            raise
+
+        index.ready = True
+        index.refreshed_at = time.monotonic()
+        index.tombstones.clear()
+        logger.info(f"Built search index for user {user_id}: {len(index.doc_lengths)} entries")
+        self._evict()
+        return index
+
+    async def _refresh(self, user_id: str, index: _UserIndex) -> None:
+        """Add entries written elsewhere since the index's newest entry"""
+        count = len(index.doc_lengths)
+        # Entries already indexed are skipped, so including the newest timestamp is safe
+        await self._load(user_id, index, since=index.newest)
+        index.refreshed_at = time.monotonic()
+        if len(index.doc_lengths) > count:
+            logger.info(f"Refreshed search index for user {user_id}: {len(index.doc_lengths) - count} new entries")
+
+    def _drop(self, index: _UserIndex, entry_ids) -> None:
+        for entry_id in entry_ids:
+            index.remove(entry_id)
+            self._owners.pop(entry_id, None)
+
+    def _evict(self) -> None:
+        while len(self._users) > self.max_users:
+            user_id, index = self._users.popitem(last=False)
+            for entry_id in index.doc_lengths:
+                self._owners.pop(entry_id, None)
+
+    async def search(self, user_id: str, query: str, offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        """Search the user's history and return one page of ranked results"""
+        if self.store.supports_search:
+            total, entries = await self.store.search(user_id, tokenize(query), offset, limit)
+            return {
+                "results": [
+                    {**entry, 'score': round(entry['score'], 4), 'timestamp': entry['timestamp'].isoformat()}
+                    for entry in entries
+                ],
+                "total": total,
+                "offset": offset,
+                "limit": limit
+            }
+
+        index = await self._get_user_index(user_id)
+        terms = tokenize(query)
+        while True:
+            total, ranked = index.search(terms, offset + limit)
+            page_ids = [entry_id for entry_id, _ in ranked[offset:]]
+            # Entries deleted by other workers are only noticed here
+            missing = set(page_ids) - await self.store.existing_ids(page_ids)
+            if not missing:
+                break
+            self._drop(index, missing)
+
+        results = []
+        for entry_id, score in ranked[offset:]:
+            preview = index.previews[entry_id]
+            results.append({
+                'id': entry_id,
+                'score': round(score, 4),
+                **preview,
+                'timestamp': datetime.fromtimestamp(preview['timestamp']).isoformat()
+            })
+
+        return {
+            "results": results,
+            "total": total,
+            "offset": offset,
+            "limit": limit
+        }
+
+# Global instance
+history_search_index = HistorySearchIndex(
+    history_store,
+    max_users=int(os.getenv("HISTORY_INDEX_MAX_USERS", "500")),
+    max_age=float(os.getenv("HISTORY_INDEX_MAX_AGE", "120"))
+)
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import re
+import time
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+from services.key_pool import key_pool
+
+logger = logging.getLogger(__name__)
+
+CONTRACTIONS = {
+    "'s ": " is ", "'re ": " are ", "n't ": " not ", "'ll ": " will ", "'m ": " am ",
+    "whats ": "what is "
+}
+
+class EmbeddingProvider:
+    """Turns prompts into fixed-size embedding vectors"""
+
+    dimension: int = 0
+
+    async def embed(self, text: str) -> np.ndarray:
+        raise NotImplementedError
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the Gemini embedding API"""
+
+    def __init__(self, model: str = "models/text-embedding-004", dimension: int = 768):
+        self.model = model
+        self.dimension = dimension
+
+    async def embed(self, text: str) -> np.ndarray:
+        import google.generativeai as genai
+
+        key = key_pool.acquire("embed")
+        try:
+            result = await asyncio.to_thread(
+                genai.embed_content,
+                model=self.model,
+                content=text,
+                task_type="semantic_similarity",
+                client=key_pool.client(key)
+            )
+        except Exception as e:
+            key_pool.report_error(key, e)
+            raise
+        key_pool.report_success(key)
+        return np.asarray(result["embedding"], dtype=np.float32)
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Local stand-in model: hashed word and character trigram features
+
+    Needs no network access, which makes it suitable for offline tests and
+    benchmarks. Similar wording yields similar vectors, but it has no notion
+    of meaning beyond shared surface forms.
+    """
+
+    def __init__(self, dimension: int = 512):
+        self.dimension = dimension
+
+    def _features(self, text: str):
+        normalized = f"{text.lower()} "
+        for contraction, expansion in CONTRACTIONS.items():
+            normalized = normalized.replace(contraction, expansion)
+        normalized = re.sub(r"[^\w\s]", "", normalized)
+        words = normalized.split()
+        yield from words
+        joined = f" {' '.join(words)} "
+        for i in range(len(joined) - 2):
+            yield joined[i:i + 3]
+
+    async def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in self._features(text):
+            vector[zlib.crc32(feature.encode()) % self.dimension] += 1.0
+        return vector
+
+class VectorIndex:
+    """Fixed-capacity matrix of normalized embeddings with LRU eviction
+
+    Every entry belongs to a namespace and searches only match entries in the
+    caller's namespace.
+    """
+
+    def __init__(self, dimension: int, capacity: int, ttl: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.namespaces = np.empty(capacity, dtype=object)
+        self.answers = [None] * capacity
+        self.size = 0
+
+    def search(self, vector: np.ndarray, namespace: str) -> Tuple[int, float]:
+        """Return the slot and cosine similarity of the closest live entry in the namespace"""
+        if not self.size:
+            return -1, 0.0
+
+        similarities = self.vectors[:self.size] @ vector
+        excluded = (self.created[:self.size] < time.time() - self.ttl) | (self.namespaces[:self.size] != namespace)
+        similarities[excluded] = -1.0
+        slot = int(np.argmax(similarities))
+        if similarities[slot] < 0:
+            return -1, 0.0
+        return slot, float(similarities[slot])
+
+    def add(self, vector: np.ndarray, namespace: str, answer: str) -> None:
+        if self.size < self.capacity:
+            slot = self.size
+            self.size += 1
+        else:
+            # Reuse an expired slot first, otherwise the least recently used one
+            expired = self.created < time.time() - self.ttl
+            slot = int(np.argmin(np.where(expired, -1.0, self.last_used)))
+
+        now = time.time()
+        self.vectors[slot] = vector
+        self.created[slot] = now
+        self.last_used[slot] = now
+        self.namespaces[slot] = namespace
+        self.answers[slot] = answer
+
+class SemanticCache:
+    """Serves stored answers for prompts that are near-duplicates of earlier ones
+
+    Callers pass the user's own prompt, not the full text sent to the model, so
+    fixed prompt templates don't dominate the similarity. Entries are looked up
+    within a namespace; GeminiService scopes it per user, request kind and
+    output budget, so answers are never shared between users.
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        threshold: float = 0.95,
+        capacity: int = 1000,
+        ttl: float = 3600.0
+    ):
+        self.provider = provider
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.index = VectorIndex(provider.dimension, capacity, ttl)
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+
+    async def lookup(self, prompt: str, namespace: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Return (cached answer or None, normalized prompt embedding)"""
+        try:
+            vector = await self.provider.embed(prompt)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None, None
+
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None, None
+        vector = vector / norm
+
+        slot, similarity = self.index.search(vector, namespace)
+        if slot >= 0 and similarity >= self.threshold:
+            self.index.last_used[slot] = time.time()
+            self.stats["hits"] += 1
+            logger.info(f"Semantic cache hit (similarity {similarity:.3f})")
+            return self.index.answers[slot], vector
+
+        self.stats["misses"] += 1
+        return None, vector
+
+    def store(self, namespace: str, vector: Optional[np.ndarray], answer: str) -> None:
+        """Remember an answer under the embedding returned by lookup()"""
+        if vector is not None and answer:
+            self.index.add(vector, namespace, answer)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "threshold": self.threshold,
+            "entries": self.index.size,
+            "capacity": self.capacity
+        }
+
+def create_embedding_provider() -> EmbeddingProvider:
+    """Create the embedding provider selected by SEMANTIC_CACHE_PROVIDER"""
+    provider = os.getenv("SEMANTIC_CACHE_PROVIDER", "gemini").lower()
+    if provider == "hashing":
+        return HashingEmbeddingProvider()
+    return GeminiEmbeddingProvider()
@@ -0,0 +1,238 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from services.firebase_service import get_async_firestore_client
+
+logger = logging.getLogger(__name__)
+
+UsageKey = Tuple[str, str]  # (userId, ISO day)
+
+class TokenBudgetExceeded(Exception):
+    """Raised before a model call when the user's daily token quota is used up"""
+
+class UsageStore:
+    """Persistence for aggregated per-user daily usage"""
+
+    # Most deltas written by one increment_many call, which is all-or-nothing
+    max_batch = 500
+
+    async def get_tokens(self, user_id: str, day: str) -> int:
+        raise NotImplementedError
+
+    async def increment_many(self, deltas: Dict[UsageKey, Dict[str, int]]) -> None:
+        raise NotImplementedError
+
+class FirestoreUsageStore(UsageStore):
+    """Usage counters in the Firestore `usage` collection, one document per user and day"""
+
+    def __init__(self, collection: str = "usage"):
+        self.collection = collection
+
+    def _doc(self, user_id: str, day: str):
+        return get_async_firestore_client().collection(self.collection).document(f"{user_id}_{day}")
+
+    async def get_tokens(self, user_id: str, day: str) -> int:
+        doc = await self._doc(user_id, day).get()
+        if not doc.exists:
+            return 0
+        data = doc.to_dict()
+        return data.get('promptTokens', 0) + data.get('responseTokens', 0)
+
+    async def increment_many(self, deltas: Dict[UsageKey, Dict[str, int]]) -> None:
+        from firebase_admin import firestore
+
+        # One batch (at most 500 writes, the Firestore limit), so it commits atomically
+        batch = get_async_firestore_client().batch()
+        for (user_id, day), delta in deltas.items():
+            batch.set(self._doc(user_id, day), {
+                'userId': user_id,
+                'day': day,
+                **{field: firestore.Increment(value) for field, value in delta.items()}
+            }, merge=True)
+        await batch.commit()
+
+class SQLiteUsageStore(UsageStore):
+    """Usage counters in a local SQLite database"""
+
+    max_batch = 10000
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                userId TEXT NOT NULL,
+                day TEXT NOT NULL,
+                promptTokens INTEGER NOT NULL DEFAULT 0,
+                responseTokens INTEGER NOT NULL DEFAULT 0,
+                requests INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (userId, day)
+            )
+        """)
+        self._conn.commit()
+
+    def _get_sync(self, user_id: str, day: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT promptTokens + responseTokens FROM usage WHERE userId = ? AND day = ?",
+                (user_id, day)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _increment_sync(self, deltas: Dict[UsageKey, Dict[str, int]]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO usage (userId, day, promptTokens, responseTokens, requests) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (userId, day) DO UPDATE SET "
+                "promptTokens = promptTokens + excluded.promptTokens, "
+                "responseTokens = responseTokens + excluded.responseTokens, "
+                "requests = requests + excluded.requests",
+                [
+                    (user_id, day, d['promptTokens'], d['responseTokens'], d['requests'])
+                    for (user_id, day), d in deltas.items()
+                ]
+            )
+
+    async def get_tokens(self, user_id: str, day: str) -> int:
+        return await asyncio.to_thread(self._get_sync, user_id, day)
+
+    async def increment_many(self, deltas: Dict[UsageKey, Dict[str, int]]) -> None:
+        await asyncio.to_thread(self._increment_sync, deltas)
+
+class UsageTracker:
+    """Aggregates token usage in memory and flushes deltas to storage in bulk
+
+    Budget checks use the persisted total (read once per user per flush
+    interval) plus this process's unflushed usage, so no storage write sits
+    on the request path. Deltas being written count as unflushed until their
+    write commits.
+    """
+
+    def __init__(self, store: UsageStore, daily_budget: int = 0, flush_interval: float = 60.0):
+        self.store = store
+        self.daily_budget = daily_budget
+        self.flush_interval = flush_interval
+        self._pending: Dict[UsageKey, Dict[str, int]] = {}
+        self._inflight: Dict[UsageKey, Dict[str, int]] = {}
+        self._persisted: Dict[UsageKey, int] = {}
+        # Bumped on every committed write, so a read that overlapped one isn't cached
+        self._commits = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def _key(self, user_id: str) -> UsageKey:
+        return user_id, date.today().isoformat()
+
+    def _unflushed_tokens(self, key: UsageKey) -> int:
+        return sum(
+            delta['promptTokens'] + delta['responseTokens']
+            for delta in (self._pending.get(key), self._inflight.get(key))
+            if delta
+        )
+
+    async def get_today_tokens(self, user_id: str) -> int:
+        key = self._key(user_id)
+        persisted = self._persisted.get(key)
+        if persisted is None:
+            commits = self._commits
+            persisted = await self.store.get_tokens(*key)
+            if commits == self._commits:
+                self._persisted[key] = persisted
+        return persisted + self._unflushed_tokens(key)
+
+    async def check_budget(self, user_id: Optional[str]) -> None:
+        """Raise TokenBudgetExceeded if the user has used up today's token quota"""
+        if not user_id or self.daily_budget <= 0:
+            return
+        try:
+            used = await self.get_today_tokens(user_id)
+        except Exception as e:
+            logger.error(f"Usage store error for user {user_id}, skipping budget check: {e}")
+            return
+        if used >= self.daily_budget:
+            raise TokenBudgetExceeded(f"Daily token quota of {self.daily_budget} exceeded")
+
+    def record(self, user_id: Optional[str], response) -> None:
+        """Add the prompt and response token counts from a Gemini response"""
+        usage = getattr(response, "usage_metadata", None)
+        if not user_id or usage is None:
+            return
+
+        delta = self._pending.setdefault(
+            self._key(user_id), {'promptTokens': 0, 'responseTokens': 0, 'requests': 0}
+        )
+        delta['promptTokens'] += getattr(usage, "prompt_token_count", 0) or 0
+        delta['responseTokens'] += getattr(usage, "candidates_token_count", 0) or 0
+        delta['requests'] += 1
+
+    async def flush(self) -> None:
+        """Write all pending deltas to storage in bulk, one atomic batch at a time"""
+        if not self._pending:
+            return
+
+        deltas, self._pending = self._pending, {}
+        self._inflight = deltas
+        keys = list(deltas)
+        size = self.store.max_batch
+        for start in range(0, len(keys), size):
+            batch = {key: deltas[key] for key in keys[start:start + size]}
+            try:
+                await self.store.increment_many(batch)
+            except Exception as e:
+                # Batches that already committed stay committed; only the rest is retried
+                unwritten = keys[start:]
+                logger.error(f"Usage flush failed, keeping {len(unwritten)} deltas for retry: {e}")
+                for key in unwritten:
+                    pending = self._pending.setdefault(key, {'promptTokens': 0, 'responseTokens': 0, 'requests': 0})
+                    for field, value in deltas[key].items():
+                        pending[field] += value
+                self._inflight = {}
+                return
+
+            # The stored totals now include these deltas; re-read them when next needed
+            self._commits += 1
+            for key in batch:
+                self._inflight.pop(key, None)
+                self._persisted.pop(key, None)
+
+        # Re-read persisted totals lazily so usage from other workers is picked up
+        self._persisted.clear()
+        logger.info(f"Flushed usage for {len(deltas)} users")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+def create_usage_store() -> UsageStore:
+    """Create the usage store matching HISTORY_BACKEND"""
+    if os.getenv("HISTORY_BACKEND", "firestore").lower() == "sqlite":
+        return SQLiteUsageStore(os.getenv("HISTORY_DB_PATH", "history.db"))
+    return FirestoreUsageStore()
+
+# Global instance
+usage_tracker = UsageTracker(
+    create_usage_store(),
+    daily_budget=int(os.getenv("DAILY_TOKEN_BUDGET", "0")),
+    flush_interval=float(os.getenv("USAGE_FLUSH_INTERVAL", "60"))
+)
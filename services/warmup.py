@@ -0,0 +1,133 @@
+import asyncio
+import importlib
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from services.firebase_service import init_firebase, warm_auth_certs
+from services.health_monitor import health_monitor
+from services.history_store import history_store
+from services.key_pool import key_pool
+
+logger = logging.getLogger(__name__)
+
+class StartupWarmup:
+    """Startup phase run from the app lifespan, before the worker takes traffic
+
+    Imports the heavy SDKs, initializes Firebase and warms the token
+    verification certificates, model clients and backend connections, so the
+    first request costs the same as any later one. Each step is timed and a
+    failing step is logged and reported without stopping the others.
+
+    Steps the worker cannot serve requests without are critical: while one of
+    them has failed the worker is not ready, and it is retried in the
+    background every `retry_interval` seconds until it succeeds. Steps that
+    only fill caches are never critical.
+    """
+
+    def __init__(self, step_timeout: float = 15.0, retry_interval: float = 30.0):
+        self.step_timeout = step_timeout
+        self.retry_interval = retry_interval
+        self.steps: Dict[str, dict] = {}
+        self.started_at: Optional[str] = None
+        self.total_ms: Optional[float] = None
+        self.done = False
+        self._critical: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _step(self, name: str, func, *args, critical: bool = False) -> None:
+        """Run one sync or async step and record how long it took"""
+        if critical:
+            self._critical[name] = (func, args)
+
+        start = time.perf_counter()
+        error = None
+        try:
+            if asyncio.iscoroutinefunction(func):
+                await asyncio.wait_for(func(*args), timeout=self.step_timeout)
+            else:
+                await asyncio.wait_for(asyncio.to_thread(func, *args), timeout=self.step_timeout)
+        except asyncio.TimeoutError:
+            error = f"timed out after {self.step_timeout:.0f}s"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+
+        elapsed = round((time.perf_counter() - start) * 1000, 1)
+        if error:
+            logger.error(f"Warmup step '{name}' failed after {elapsed}ms: {error}")
+        self.steps[name] = {
+            "step": name,
+            "ms": elapsed,
+            "ok": error is None,
+            "critical": critical,
+            "error": error
+        }
+
+    def failed_critical_steps(self) -> List[str]:
+        return [name for name in self._critical if not self.steps[name]["ok"]]
+
+    async def run(self) -> None:
+        self.started_at = datetime.now().isoformat()
+        start = time.perf_counter()
+
+        await self._step("import google.generativeai", importlib.import_module, "google.generativeai")
+        await self._step("import firebase_admin", importlib.import_module, "firebase_admin.auth", critical=True)
+        await self._step("import firestore", importlib.import_module, "firebase_admin.firestore_async")
+        await self._step("init firebase", init_firebase, critical=True)
+        # The remaining steps only do network I/O, so they overlap
+        await asyncio.gather(
+            self._step("auth certificates", warm_auth_certs),
+            self._step("model clients", key_pool.warm),
+            self._step("history store", history_store.warmup, critical=True)
+        )
+        await self._step("model probes", health_monitor.probe_all)
+
+        self.total_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.done = True
+        breakdown = ", ".join(f"{step['step']}={step['ms']}ms" for step in self.steps.values())
+        logger.info(f"Startup warmup finished in {self.total_ms}ms: {breakdown}")
+
+        if self.failed_critical_steps():
+            self._task = asyncio.create_task(self._retry_failed())
+
+    async def _retry_failed(self) -> None:
+        while self.failed_critical_steps():
+            await asyncio.sleep(self.retry_interval)
+            # Steps run in order, so a step is retried only after the ones it depends on
+            for name in self.failed_critical_steps():
+                func, args = self._critical[name]
+                await self._step(name, func, *args, critical=True)
+                if not self.steps[name]["ok"]:
+                    break
+        logger.info("All critical warmup steps have succeeded")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_ready(self) -> bool:
+        """Warmup finished and no critical step is failing"""
+        return self.done and not self.failed_critical_steps()
+
+    def get_report(self) -> dict:
+        return {
+            "done": self.done,
+            "ready": self.is_ready(),
+            "startedAt": self.started_at,
+            "totalMs": self.total_ms,
+            "failedCriticalSteps": self.failed_critical_steps(),
+            "steps": list(self.steps.values())
+        }
+
+# Global instance
+startup_warmup = StartupWarmup(
+    step_timeout=float(os.getenv("WARMUP_STEP_TIMEOUT", "15")),
+    retry_interval=float(os.getenv("WARMUP_RETRY_INTERVAL", "30"))
+)
@@ -5,8 +5,11 @@ Test script for Whyred AI FastAPI backend
 import httpx
 import asyncio
 import json
+import os
 
 BASE_URL = "http://localhost:8000"
+# Firebase ID token for the authenticated endpoints; they are skipped without one
+ID_TOKEN = os.getenv("TEST_ID_TOKEN")
 
 async def test_endpoints():
     """Test all API endpoints"""
@@ -47,6 +50,67 @@ async def test_endpoints():
             print(f"   Response: {response.json()}\n")
         except Exception as e:
             print(f"❌ Ask test endpoint failed: {e}\n")
+        
+        # Test liveness probe
+        try:
+            response = await client.get(f"{BASE_URL}/api/ask/live")
+            print(f"✅ Liveness endpoint: {response.status_code}")
+            print(f"   Response: {response.json()}\n")
+        except Exception as e:
+            print(f"❌ Liveness endpoint failed: {e}\n")
+        
+        # Test readiness probe (503 while a critical startup step is failing)
+        try:
+            response = await client.get(f"{BASE_URL}/api/ask/ready")
+            print(f"✅ Readiness endpoint: {response.status_code}")
+            print(f"   Response: {response.json()}\n")
+        except Exception as e:
+            print(f"❌ Readiness endpoint failed: {e}\n")
+        
+        if not ID_TOKEN:
+            print("⚠️  Set TEST_ID_TOKEN to test the authenticated endpoints\n")
+            return
+        
+        headers = {"Authorization": f"Bearer {ID_TOKEN}"}
+        
+        # Test queue statistics endpoint
+        try:
+            response = await client.get(f"{BASE_URL}/api/ask/queue", headers=headers)
+            print(f"✅ Queue endpoint: {response.status_code}")
+            print(f"   Response: {response.json()}\n")
+        except Exception as e:
+            print(f"❌ Queue endpoint failed: {e}\n")
+        
+        # Test key pool endpoint (403 unless the token has the admin claim)
+        try:
+            response = await client.get(f"{BASE_URL}/api/ask/keys", headers=headers)
+            print(f"✅ Key pool endpoint: {response.status_code}")
+            print(f"   Response: {response.json()}\n")
+        except Exception as e:
+            print(f"❌ Key pool endpoint failed: {e}\n")
+        
+        # Test history search endpoint
+        try:
+            response = await client.get(f"{BASE_URL}/api/history/search", params={"q": "test"}, headers=headers)
+            print(f"✅ History search endpoint: {response.status_code}")
+            print(f"   Response: {response.json()}\n")
+        except Exception as e:
+            print(f"❌ History search endpoint failed: {e}\n")
+        
+        # Test history export endpoint (NDJSON stream)
+        try:
+            lines = 0
+            async with client.stream(
+                "GET", f"{BASE_URL}/api/history/export", params={"page_size": 100}, headers=headers
+            ) as response:
+                async for line in response.aiter_lines():
+                    if line:
+                        json.loads(line)
+                        lines += 1
+            print(f"✅ History export endpoint: {response.status_code}")
+            print(f"   Exported entries: {lines}\n")
+        except Exception as e:
+            print(f"❌ History export endpoint failed: {e}\n")
 
 if __name__ == "__main__":
     print("Make sure the FastAPI server is running with: python start.py")
@@ -0,0 +1,10 @@
+import time
+
+import pytest
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze time.time(); tests move it forward by changing clock[0]"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
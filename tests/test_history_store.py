@@ -0,0 +1,222 @@
+import asyncio
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.history_store import SQLiteHistoryStore, compress_body, decompress_body, zstandard
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "history.db")
+
+@pytest.fixture
+def store(path):
+    return SQLiteHistoryStore(path)
+
+def run(coro):
+    return asyncio.run(coro)
+
+def add(store, user_id: str = "alice", prompt: str = "hello", response: str = "world", seconds: int = 0, **fields):
+    entry = {
+        'userId': user_id,
+        'prompt': prompt,
+        'response': response,
+        'type': 'text',
+        'timestamp': START + timedelta(seconds=seconds),
+        **fields
+    }
+    return run(store.add(entry))
+
+def page_all(store, user_id: str, limit: int, cursor=None, **kwargs) -> list:
+    ids = []
+    while True:
+        entries, cursor = run(store.page_for_user(user_id, limit, cursor, **kwargs))
+        ids += [entry['id'] for entry in entries]
+        if not cursor:
+            return ids
+
+def search(store, user_id: str, *terms: str, offset: int = 0, limit: int = 20):
+    total, results = run(store.search(user_id, list(terms), offset, limit))
+    return total, [result['prompt'] for result in results]
+
+def test_add_and_get_round_trip(store):
+    entry_id = add(store, prompt="what is python", response="A language", searchResults=[{"title": "Python"}])
+
+    entry = run(store.get(entry_id))
+
+    assert entry['userId'] == "alice"
+    assert entry['prompt'] == "what is python"
+    assert entry['response'] == "A language"
+    assert entry['searchResults'] == [{"title": "Python"}]
+    assert entry['timestamp'] == START
+    assert run(store.get("missing")) is None
+
+def test_index_reads_return_preview_without_body(store):
+    long_response = "x" * 500
+    entry_id = add(store, response=long_response)
+
+    listed = run(store.list_for_user("alice"))[0]
+    index_only = run(store.get(entry_id, include_body=False))
+
+    for entry in (listed, index_only):
+        assert 'response' not in entry
+        assert entry['responsePreview'] == long_response[:200]
+
+def test_pages_are_newest_first_and_complete(store):
+    ids = [add(store, seconds=i) for i in range(7)]
+
+    assert page_all(store, "alice", 3) == ids[::-1]
+
+def test_paging_breaks_timestamp_ties_by_id(store):
+    # Same timestamp for every entry: only the id tie-break keeps pages disjoint
+    ids = [add(store, seconds=0) for _ in range(7)]
+
+    paged = page_all(store, "alice", 2)
+
+    assert paged == sorted(ids, reverse=True)
+
+def test_resume_from_any_entry_returns_the_rest(store):
+    # An interrupted export resumes with the id of the last entry it sent
+    ids = [add(store, seconds=i) for i in range(6)][::-1]
+
+    assert page_all(store, "alice", 2, cursor=ids[2], include_bodies=True) == ids[3:]
+
+def test_unknown_or_foreign_cursor_is_rejected(store):
+    bob_id = add(store, user_id="bob")
+
+    with pytest.raises(ValueError):
+        run(store.page_for_user("alice", 10, "missing"))
+    with pytest.raises(ValueError):
+        run(store.page_for_user("alice", 10, bob_id))
+
+def test_page_since_returns_only_newer_entries(store):
+    ids = [add(store, seconds=i) for i in range(5)]
+
+    entries, _ = run(store.page_for_user("alice", 10, since=START + timedelta(seconds=3)))
+
+    assert [entry['id'] for entry in entries] == [ids[4], ids[3]]
+
+def test_existing_ids(store):
+    kept, deleted = add(store), add(store)
+    run(store.delete(deleted))
+
+    assert run(store.existing_ids([kept, deleted, "missing"])) == {kept}
+    assert run(store.existing_ids([])) == set()
+
+def test_legacy_inline_bodies_are_normalized(store, path):
+    # Entries written before bodies were split keep the response in the index row
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO chat_history (id, userId, timestamp, data) VALUES (?, ?, ?, ?)",
+        ("legacy", "alice", START.timestamp(), json.dumps({'prompt': "old", 'response': "inline answer"}))
+    )
+    conn.commit()
+    conn.close()
+
+    full = run(store.get("legacy"))
+    index_only = run(store.list_for_user("alice"))[0]
+
+    assert full['response'] == "inline answer"
+    assert index_only['responsePreview'] == "inline answer"
+    assert 'response' not in index_only
+
+def test_zlib_body_round_trip():
+    body = {'response': "é" * 1000, 'searchResults': [{"title": "t"}]}
+
+    codec, data = compress_body(body, "zlib")
+
+    assert codec == "zlib"
+    assert len(data) < len(json.dumps(body))
+    assert decompress_body(codec, data) == body
+
+def test_zstd_body_round_trip(path):
+    if zstandard is None:
+        pytest.skip("zstandard is not installed")
+    store = SQLiteHistoryStore(path, body_codec="zstd")
+    entry_id = add(store, response="compressed " * 100)
+
+    assert run(store.get(entry_id))['response'] == "compressed " * 100
+    assert run(SQLiteHistoryStore(path).get(entry_id))['response'] == "compressed " * 100
+
+def test_zstd_falls_back_to_zlib_when_unavailable(path):
+    if zstandard is not None:
+        pytest.skip("zstandard is installed")
+    store = SQLiteHistoryStore(path, body_codec="zstd")
+
+    assert store.body_codec == "zlib"
+    assert run(store.get(add(store)))['response'] == "world"
+
+def test_search_ranks_matches_and_pages(store):
+    add(store, prompt="python packaging", response="use pip and wheels", seconds=0)
+    add(store, prompt="python python tips", response="python idioms", seconds=1)
+    add(store, prompt="rust ownership", response="borrow checker", seconds=2)
+
+    total, prompts = search(store, "alice", "python")
+    assert total == 2
+    assert prompts == ["python python tips", "python packaging"]
+
+    assert search(store, "alice", "python", offset=1, limit=1) == (2, ["python packaging"])
+    assert search(store, "alice", "python", "borrow")[0] == 3
+    assert search(store, "alice") == (0, [])
+
+def test_search_is_isolated_per_owner(store):
+    # FTS5 matching ignores case, so owners differing only in case must not mix
+    add(store, user_id="alice", prompt="secret plans")
+    add(store, user_id="Alice", prompt="public notes")
+    add(store, user_id="bob", prompt="secret recipe")
+
+    assert search(store, "alice", "secret") == (1, ["secret plans"])
+    assert search(store, "Alice", "secret") == (0, [])
+    assert search(store, "Alice", "notes") == (1, ["public notes"])
+
+def test_search_terms_are_matched_literally(store):
+    # FTS5 query syntax in a term is quoted, not interpreted
+    add(store, prompt='say "hi" OR NOT')
+
+    assert search(store, "alice", 'hi"')[0] == 1
+    assert search(store, "alice", "or", "not")[0] == 1
+    assert search(store, "alice", "NEAR(", "*")[0] == 0
+
+def test_deleted_and_cleared_entries_leave_search(store):
+    first = add(store, prompt="apple pie")
+    add(store, prompt="apple tart")
+    add(store, user_id="bob", prompt="apple juice")
+
+    run(store.delete(first))
+    assert search(store, "alice", "apple") == (1, ["apple tart"])
+
+    assert run(store.clear_for_user("alice")) == 1
+    assert search(store, "alice", "apple") == (0, [])
+    assert search(store, "bob", "apple") == (1, ["apple juice"])
+
+def test_existing_entries_are_indexed_for_search_on_upgrade(store, path):
+    add(store, prompt="written before search existed")
+    store._conn.execute("DROP TABLE chat_history_fts")
+
+    reopened = SQLiteHistoryStore(path)
+
+    assert search(reopened, "alice", "search") == (1, ["written before search existed"])
+
+def test_observers_are_notified(store):
+    events = []
+
+    class Observer:
+        def on_added(self, entry_id, entry):
+            events.append(("added", entry['userId']))
+
+        def on_deleted(self, entry_id):
+            events.append(("deleted", entry_id))
+
+        def on_cleared(self, user_id):
+            events.append(("cleared", user_id))
+
+    store.subscribe(Observer())
+    entry_id = add(store)
+    run(store.delete(entry_id))
+    run(store.clear_for_user("alice"))
+
+    assert events == [("added", "alice"), ("deleted", entry_id), ("cleared", "alice")]
@@ -0,0 +1,107 @@
+import pytest
+
+from services.key_pool import KeyPool
+
+class FakeModel:
+    """Stands in for GenerativeModel; bind() only sets its client"""
+
+    def __init__(self):
+        self._client = None
+
+class Boom(Exception):
+    pass
+
+def test_acquire_spreads_calls_over_keys(clock):
+    pool = KeyPool(["key-aaaa", "key-bbbb"])
+
+    names = [pool.acquire().name for _ in range(4)]
+
+    assert names == ["key-0", "key-1", "key-0", "key-1"]
+
+def test_purposes_have_separate_windows(clock):
+    pool = KeyPool(["key-aaaa"], rpm_limit=2)
+    for _ in range(5):
+        pool.acquire("probe")
+    pool.acquire("embed")
+    pool.acquire("generate")
+
+    stats = pool.get_stats()[0]
+
+    assert stats["requestsLastMinute"] == {"generate": 1, "embed": 1, "probe": 5}
+    assert stats["generateHeadroom"] == 1
+
+def test_window_drops_requests_older_than_a_minute(clock):
+    pool = KeyPool(["key-aaaa"])
+    pool.acquire()
+    clock[0] += 61
+
+    assert pool.get_stats()[0]["requestsLastMinute"]["generate"] == 0
+
+def test_quota_error_cools_key_down_with_backoff(clock):
+    pool = KeyPool(["key-aaaa", "key-bbbb"], base_cooldown=30, max_cooldown=100)
+    key = pool.acquire()
+
+    pool.report_error(key, Exception("429 Resource has been exhausted (e.g. check quota)"))
+    assert [pool.acquire().name for _ in range(3)] == ["key-1"] * 3
+
+    pool.report_error(key, Exception("429 quota"))
+    pool.report_error(key, Exception("429 quota"))
+    assert key.cooldown == 100
+
+    clock[0] += 101
+    assert pool.acquire().name == "key-0"
+
+def test_other_errors_do_not_cool_down(clock):
+    pool = KeyPool(["key-aaaa"])
+    key = pool.acquire()
+
+    pool.report_error(key, ValueError("invalid argument"))
+
+    assert key.errors == 1
+    assert not pool.get_stats()[0]["coolingDown"]
+
+def test_stats_never_show_key_material():
+    pool = KeyPool(["AIzaSecretKey1234"])
+    pool.acquire()
+
+    assert "1234" not in str(pool.get_stats())
+
+def test_without_keys_bind_leaves_the_model_alone():
+    model = FakeModel()
+
+    assert KeyPool([]).bind(model) is None
+    assert model._client is None
+
+# The pool relies on google-generativeai internals (client._ClientManager and
+# GenerativeModel._client); these tests fail if an SDK upgrade renames them
+
+def test_bind_sets_a_client_per_key():
+    pytest.importorskip("google.generativeai")
+    pool = KeyPool(["key-aaaa", "key-bbbb"])
+    first, second = FakeModel(), FakeModel()
+
+    first_key = pool.bind(first)
+    second_key = pool.bind(second)
+
+    assert first_key.name == "key-0" and second_key.name == "key-1"
+    assert first._client is pool.client(first_key)
+    assert second._client is pool.client(second_key)
+    assert first._client is not second._client
+
+def test_generative_model_calls_go_through_the_bound_client():
+    genai = pytest.importorskip("google.generativeai")
+    pool = KeyPool(["key-aaaa"])
+    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+    # The SDK creates the client lazily, so one set up front is the one used
+    assert model._client is None
+
+    key = pool.bind(model)
+    assert model._client is pool.client(key)
+
+    class FakeClient:
+        def generate_content(self, *args, **kwargs):
+            raise Boom()
+
+    pool._clients[key.key] = model._client = FakeClient()
+    with pytest.raises(Boom):
+        model.generate_content("ping")
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from services.rate_limiter import RateLimiter, SQLiteRateLimitStore, parse_limit, take_token
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteRateLimitStore(str(tmp_path / "ratelimit.db"))
+
+def take(store, key: str = "model:user:alice", capacity: int = 3, period: float = 60, cost: float = 1):
+    return asyncio.run(store.take(key, capacity, period, cost))
+
+@pytest.mark.parametrize("limit, expected", [
+    ("100/15minutes", (100, 900)),
+    ("5/minute", (5, 60)),
+    ("10 / 2 hours", (10, 7200)),
+    ("1000/day", (1000, 86400)),
+    ("3/second", (3, 1)),
+])
+def test_parse_limit(limit, expected):
+    assert parse_limit(limit) == expected
+
+@pytest.mark.parametrize("limit", ["100", "100/fortnight", "/minute", "ten/minute"])
+def test_parse_limit_rejects_invalid(limit):
+    with pytest.raises(ValueError):
+        parse_limit(limit)
+
+def test_take_token_refills_at_capacity_per_period():
+    tokens, result = take_token(0.0, 30.0, capacity=10, period=60, cost=1)
+    assert result.allowed
+    assert tokens == pytest.approx(4.0)
+
+    tokens, result = take_token(0.0, 3.0, capacity=10, period=60, cost=1)
+    assert not result.allowed
+    assert result.retry_after == pytest.approx(3.0)
+
+def test_take_token_never_exceeds_capacity():
+    tokens, _ = take_token(5.0, 3600.0, capacity=10, period=60, cost=1)
+    assert tokens == pytest.approx(9.0)
+
+def test_bucket_allows_burst_then_limits(store, clock):
+    results = [take(store) for _ in range(4)]
+
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert [r.remaining for r in results] == [2, 1, 0, 0]
+    assert results[-1].retry_after == pytest.approx(20.0)
+
+def test_bucket_refills_over_time(store, clock):
+    for _ in range(3):
+        take(store)
+
+    clock[0] += 20
+    assert take(store).allowed
+    assert not take(store).allowed
+
+    clock[0] += 60
+    assert take(store).remaining == 2
+
+def test_buckets_are_per_key(store, clock):
+    for _ in range(3):
+        take(store, "model:user:alice")
+
+    assert not take(store, "model:user:alice").allowed
+    assert take(store, "model:user:bob").allowed
+
+def test_bucket_is_shared_between_store_instances(tmp_path, clock):
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteRateLimitStore(path), SQLiteRateLimitStore(path)
+
+    assert take(first).allowed
+    assert take(second).allowed
+    assert take(first).allowed
+    assert not take(second).allowed
+
+def test_limiter_scopes_have_separate_buckets(store, clock):
+    limiter = RateLimiter(store, {"model": "1/minute", "api": "2/minute"})
+
+    async def run():
+        return [
+            (await limiter.hit("model", "user:alice")).allowed,
+            (await limiter.hit("model", "user:alice")).allowed,
+            (await limiter.hit("api", "user:alice")).allowed,
+        ]
+
+    assert asyncio.run(run()) == [True, False, True]
+    assert limiter.capacity("api") == 2
+
+def test_dependency_fails_open_when_store_errors(monkeypatch):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi import Depends, FastAPI
+    from fastapi.testclient import TestClient
+
+    from middleware.auth import get_current_user
+    from middleware.rate_limit import rate_limit
+    from services.rate_limiter import rate_limiter
+
+    async def broken(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(rate_limiter.store, "take", broken)
+    app = FastAPI()
+    app.dependency_overrides[get_current_user] = lambda: {"uid": "alice"}
+
+    @app.get("/", dependencies=[Depends(rate_limit("api"))])
+    async def endpoint():
+        return {"ok": True}
+
+    assert TestClient(app).get("/").status_code == 200
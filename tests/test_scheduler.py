@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from services.scheduler import FairScheduler
+
+async def call(scheduler: FairScheduler, order: list, label: str, user_id: str, priority: str = "interactive"):
+    async with scheduler.slot(user_id, priority):
+        order.append(label)
+        await asyncio.sleep(0)
+
+async def serve(scheduler: FairScheduler, requests: list, before_release=None) -> list:
+    """Queue requests behind a held slot in the given order, then release it"""
+    order = []
+    release = asyncio.Event()
+
+    async def blocker():
+        async with scheduler.slot("blocker"):
+            await release.wait()
+
+    tasks = [asyncio.create_task(blocker())]
+    await asyncio.sleep(0)
+    for label, user_id, priority in requests:
+        tasks.append(asyncio.create_task(call(scheduler, order, label, user_id, priority)))
+        await asyncio.sleep(0)
+
+    if before_release:
+        await before_release(tasks)
+    release.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return order
+
+def test_users_share_slots_round_robin():
+    scheduler = FairScheduler(max_concurrency=1)
+    requests = [
+        ("a1", "alice", "interactive"),
+        ("a2", "alice", "interactive"),
+        ("a3", "alice", "interactive"),
+        ("b1", "bob", "interactive"),
+        ("c1", "carol", "interactive"),
+    ]
+
+    order = asyncio.run(serve(scheduler, requests))
+
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+def test_higher_priority_class_goes_first():
+    scheduler = FairScheduler(max_concurrency=1)
+    requests = [
+        ("batch", "alice", "batch"),
+        ("code", "bob", "code"),
+        ("interactive", "carol", "interactive"),
+    ]
+
+    order = asyncio.run(serve(scheduler, requests))
+
+    assert order == ["interactive", "code", "batch"]
+
+def test_starved_class_is_served_after_max_wait():
+    scheduler = FairScheduler(max_concurrency=1, max_wait=0.05)
+    requests = [
+        ("batch", "alice", "batch"),
+        ("i1", "bob", "interactive"),
+        ("i2", "carol", "interactive"),
+    ]
+
+    async def wait_past_max_wait(tasks):
+        await asyncio.sleep(0.06)
+
+    order = asyncio.run(serve(scheduler, requests, wait_past_max_wait))
+
+    assert order[0] == "batch"
+
+def test_cancelled_waiter_leaves_queue():
+    scheduler = FairScheduler(max_concurrency=1)
+    requests = [
+        ("a1", "alice", "interactive"),
+        ("b1", "bob", "interactive"),
+    ]
+
+    async def cancel_alice(tasks):
+        tasks[1].cancel()
+        await asyncio.sleep(0)
+        assert scheduler.get_user_stats("alice")["queued"] == 0
+        assert scheduler.queued() == 1
+
+    order = asyncio.run(serve(scheduler, requests, cancel_alice))
+
+    assert order == ["b1"]
+    assert scheduler.get_stats()["active"] == 0
+    assert scheduler.queued() == 0
+
+def test_wait_stats_are_bounded():
+    scheduler = FairScheduler(max_concurrency=1, max_tracked_users=2)
+
+    async def run():
+        for user_id in ("alice", "bob", "carol"):
+            async with scheduler.slot(user_id):
+                pass
+
+    asyncio.run(run())
+
+    assert scheduler.get_user_stats("alice")["requests"] == 0
+    assert scheduler.get_user_stats("carol")["requests"] == 1
+
+@pytest.mark.parametrize("priority", ["interactive", "code", "batch", "unknown"])
+def test_slot_is_released_on_error(priority):
+    scheduler = FairScheduler(max_concurrency=1)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            async with scheduler.slot("alice", priority):
+                raise RuntimeError("model failed")
+
+    asyncio.run(run())
+
+    assert scheduler.get_stats()["active"] == 0
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from services.semantic_cache import HashingEmbeddingProvider, SemanticCache, VectorIndex
+
+NAMESPACE = "alice:text:2048"
+
+def make_cache(**kwargs) -> SemanticCache:
+    return SemanticCache(HashingEmbeddingProvider(), **kwargs)
+
+def remember(cache: SemanticCache, prompt: str, answer: str, namespace: str = NAMESPACE) -> None:
+    _, vector = asyncio.run(cache.lookup(prompt, namespace))
+    cache.store(namespace, vector, answer)
+
+def lookup(cache: SemanticCache, prompt: str, namespace: str = NAMESPACE):
+    return asyncio.run(cache.lookup(prompt, namespace))[0]
+
+def unit(values) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def test_near_duplicate_prompt_hits():
+    cache = make_cache()
+    remember(cache, "what is python", "A programming language")
+
+    assert lookup(cache, "What's Python?") == "A programming language"
+    assert lookup(cache, "whats python") == "A programming language"
+    assert cache.stats["hits"] == 2
+
+def test_different_prompt_below_threshold_misses():
+    cache = make_cache()
+    remember(cache, "what is python", "A programming language")
+
+    assert lookup(cache, "what is rust") is None
+    assert lookup(cache, "reverse a string") is None
+
+def test_threshold_is_configurable():
+    cache = make_cache(threshold=0.5)
+    remember(cache, "what is python", "A programming language")
+
+    assert lookup(cache, "what is rust") == "A programming language"
+
+def test_entries_are_scoped_to_namespace():
+    cache = make_cache()
+    remember(cache, "what is python", "Alice's answer")
+
+    assert lookup(cache, "what is python", "bob:text:2048") is None
+    assert lookup(cache, "what is python", "alice:code:8192") is None
+    assert lookup(cache, "what is python") == "Alice's answer"
+
+def test_expired_entry_is_not_served(clock):
+    cache = make_cache(ttl=60)
+    remember(cache, "what is python", "A programming language")
+
+    clock[0] += 61
+    assert lookup(cache, "what is python") is None
+
+def test_eviction_replaces_least_recently_used(clock):
+    index = VectorIndex(dimension=3, capacity=2, ttl=3600)
+    index.add(unit([1, 0, 0]), NAMESPACE, "first")
+    clock[0] += 1
+    index.add(unit([0, 1, 0]), NAMESPACE, "second")
+    clock[0] += 1
+    slot, _ = index.search(unit([1, 0, 0]), NAMESPACE)
+    index.last_used[slot] = time.time()
+
+    clock[0] += 1
+    index.add(unit([0, 0, 1]), NAMESPACE, "third")
+
+    assert sorted(index.answers) == ["first", "third"]
+
+def test_eviction_prefers_expired_entries(clock):
+    index = VectorIndex(dimension=3, capacity=2, ttl=60)
+    index.add(unit([1, 0, 0]), NAMESPACE, "old")
+    clock[0] += 50
+    index.add(unit([0, 1, 0]), NAMESPACE, "recent")
+    clock[0] += 20
+    # "old" has expired; it goes even though "recent" was used less recently
+    index.last_used[0] = time.time()
+
+    index.add(unit([0, 0, 1]), NAMESPACE, "new")
+
+    assert sorted(index.answers) == ["new", "recent"]